@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+# The particle model imports matplotlib. Make sure it never needs a display.
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'modified_model'))
+
+
+GRID_SIZES = [50, 100, 200, 500, 1000, 2000]
+PARTICLE_SIZES = [100, 300, 1000, 3000, 10000, 30000, 100000]
+
+
+def main(*args):
+    """Benchmark both simulation models over a ladder of sizes.
+
+    $ python benchmark.py                           # run and print results
+    $ python benchmark.py --file=before.json        # save results as JSON
+    $ python benchmark.py --compare before.json after.json
+
+    Every case runs in its own process with a fixed seed. A case that takes
+    longer than --timeout seconds is stopped and the larger sizes of that
+    model are skipped.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the simulations')
+    parser.add_argument('--models', metavar='NAMES', type=str, default='grid,particles',
+                        help='Comma separated models to benchmark (grid, particles)')
+    parser.add_argument('--grid-sizes', metavar='N,...', type=str,
+                        default=','.join(map(str, GRID_SIZES)),
+                        help='Grid sizes N (N x N grid)')
+    parser.add_argument('--particle-sizes', metavar='N,...', type=str,
+                        default=','.join(map(str, PARTICLE_SIZES)),
+                        help='Numbers of particles')
+    parser.add_argument('--days', metavar='T', type=int, default=10,
+                        help='Simulated days to time for each case')
+    parser.add_argument('--engine', metavar='NAME', type=str, default='numpy',
+                        help='Engine of the grid model')
+    parser.add_argument('--seed', metavar='N', type=int, default=0,
+                        help='Seed for every case')
+    parser.add_argument('--timeout', metavar='S', type=float, default=300,
+                        help='Give up on a case (and larger ones) after S seconds')
+    parser.add_argument('--file', metavar='FILE', type=str, default=None,
+                        help='Save the results as JSON to FILE')
+    parser.add_argument('--compare', metavar='FILE', type=str, nargs=2, default=None,
+                        help='Compare two saved results instead of running')
+    parser.add_argument('--threshold', metavar='X', type=float, default=0.1,
+                        help='With --compare, fail if a case is more than X (fraction) slower')
+    args = parser.parse_args(args)
+
+    if args.compare is not None:
+        old, new = (load_results(filename) for filename in args.compare)
+        return compare_results(old, new, args.threshold)
+
+    cases = []
+    models = args.models.split(',')
+    if 'grid' in models:
+        cases.append(('grid', [int(n) for n in args.grid_sizes.split(',')]))
+    if 'particles' in models:
+        cases.append(('particles', [int(n) for n in args.particle_sizes.split(',')]))
+
+    results = []
+    for model, sizes in cases:
+        for size in sizes:
+            result = run_case(model, size, args.days, args.seed, args.engine,
+                              args.timeout)
+            print_result(result)
+            results.append(result)
+            if result['status'] != 'ok':
+                break
+
+    output = {'meta': get_meta(args), 'results': results}
+    if args.file is not None:
+        with open(args.file, 'w') as outfile:
+            json.dump(output, outfile, indent=2)
+    return 0
+
+
+def get_meta(args):
+    """Information about the machine and settings of a benchmark run"""
+    return {
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'days': args.days,
+        'seed': args.seed,
+        'engine': args.engine,
+    }
+
+
+def make_grid(size, seed, engine):
+    """Grid simulation of size x size at the default density of model_runsim"""
+    from model_sir import Simulation
+
+    simulation = Simulation(size, size, 0.02, 0.03, 0.002, 0, 0, 0.05, 0.005,
+                            engine=engine, seed=seed)
+    simulation.population(size * size * 6 // 10)
+    simulation.infect_randomly(max(2, size * size // 5000))
+    return simulation
+
+
+def make_particles(size, seed, engine=None):
+    """Particle simulation of size people at the default density of simulation.py"""
+    from simulation import Simulation
+
+    # Shrink people as there are more of them so that they fit in the box.
+    radius = 0.01 * np.sqrt(200 / size)
+    simulation = Simulation(size, radius, max(4, size // 50), 1, {}, seed=seed)
+    simulation.age_setter()
+    return simulation
+
+
+# Each function advances its simulation by one day and returns the number
+# of steps that took.
+
+def step_grid(simulation):
+    simulation.update()
+    return 1
+
+
+def step_particles(simulation):
+    for _ in range(simulation.steps_per_day):
+        simulation.step(0.01)
+    return simulation.steps_per_day
+
+
+MODELS = {
+    'grid': (make_grid, step_grid),
+    'particles': (make_particles, step_particles),
+}
+
+
+def measure(model, size, days, seed, engine, results):
+    """Time one case and measure its peak memory (run in a child process)"""
+    make, step = MODELS[model]
+
+    start = time.perf_counter()
+    simulation = make(size, seed, engine)
+    setup_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    steps = 0
+    for day in range(days):
+        steps += step(simulation)
+    seconds = time.perf_counter() - start
+    del simulation
+
+    # Memory is measured separately as tracing slows everything down.
+    tracemalloc.start()
+    step(make(size, seed, engine))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    results.put({
+        'setup_seconds': setup_seconds,
+        'seconds': seconds,
+        'steps_per_second': steps / seconds,
+        'seconds_per_day': seconds / days,
+        'peak_memory_mb': peak / 2**20,
+    })
+
+
+def run_case(model, size, days, seed, engine, timeout):
+    """Run one case in a new process, giving up after timeout seconds"""
+    result = {'model': model, 'size': size, 'days': days}
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=measure,
+                        args=(model, size, days, seed, engine, results))
+    process.start()
+    process.join(timeout)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+        result['status'] = 'timeout'
+        return result
+
+    try:
+        result.update(results.get(timeout=5))
+        result['status'] = 'ok'
+    except queue.Empty:
+        # The case raised an exception (printed by the child process).
+        result['status'] = 'failed'
+    return result
+
+
+def print_result(result):
+    name = '%s %d' % (result['model'], result['size'])
+    if result['status'] != 'ok':
+        print('%-18s %s' % (name, result['status']))
+    else:
+        print('%-18s %10.3f steps/s %10.4f s/day %9.1f MB  (setup %.2f s)'
+              % (name, result['steps_per_second'], result['seconds_per_day'],
+                 result['peak_memory_mb'], result['setup_seconds']))
+
+
+def load_results(filename):
+    with open(filename) as infile:
+        return json.load(infile)
+
+
+def compare_results(old, new, threshold):
+    """Print the change in time per day of every case and check for slowdowns
+
+    Returns 1 (for use as an exit status) if any case got slower by more
+    than the fraction threshold, or a case that ran before now timed out,
+    failed or is missing, otherwise 0.
+    """
+    old_cases = {(r['model'], r['size']): r for r in old['results']
+                 if r['status'] == 'ok'}
+    regressions = 0
+    seen = set()
+    for result in new['results']:
+        key = (result['model'], result['size'])
+        name = '%s %d' % key
+        seen.add(key)
+        if key not in old_cases:
+            status = 'new' if result['status'] == 'ok' else result['status']
+            print('%-18s %s' % (name, status))
+            continue
+        if result['status'] != 'ok':
+            print('%-18s %s  REGRESSION' % (name, result['status']))
+            regressions += 1
+            continue
+        ratio = result['seconds_per_day'] / old_cases[key]['seconds_per_day']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print('%-18s %10.4f -> %10.4f s/day (x%.2f)%s'
+              % (name, old_cases[key]['seconds_per_day'],
+                 result['seconds_per_day'], ratio, flag))
+    for key in old_cases:
+        if key not in seen:
+            print('%-18s missing  REGRESSION' % ('%s %d' % key))
+            regressions += 1
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,373 @@
+import math
+import numpy as np
+from multiprocessing import Pool
+import os
+
+from model_sir import Simulation
+from model_ensemble import BANDS, QUANTILES, run_replicate
+
+
+class AggregateSimulation:
+    """The grid model on counts alone, for many replicates at once
+
+    With 'mix' movement and no lockdown everyone is moved to a random cell
+    every day, so the grid is well mixed. Instead of the grid this keeps the
+    number of people in each status and draws the daily changes from
+    binomial distributions with the same rules as Simulation.update:
+
+        recoveries   Binomial(infected, recovery)
+        deaths       Binomial(infected - recoveries, death)
+        infections   Binomial(susceptible, p)
+
+    where p is the chance that a susceptible person in a random cell gets
+    infected: each of its 8 neighbours (5 at the edges, 3 in the corners)
+    is infected with probability infected / (cells - 1) and k infected
+    neighbours infect with probability min(1, k * infection). The capacity
+    switching rule is applied to every replicate separately.
+
+    During a lockdown nobody moves in the grid model, so infected people
+    cluster and the grid is no longer well mixed. That cannot be described
+    by the counts alone, so lockdown must be 0 (a ValueError is raised
+    otherwise).
+
+    Every day costs the same whatever the grid size and all replicates are
+    advanced together with array operations. counts has shape (replicates,
+    len(STATUSES)).
+
+    Example
+    =======
+
+    >>> sim = AggregateSimulation(100, 100, 0.02, 0.03, 0.002, 2000, 0,
+    ...                           0.05, 0.005, replicates=100000)
+    >>> sim.population(6000)
+    >>> sim.infect_randomly(2)
+    >>> for day in range(365):
+    ...     sim.update()
+    >>> dead = sim.counts[:, sim.DEAD]
+
+    """
+
+    SPACE = Simulation.SPACE
+    SUSCEPTIBLE = Simulation.SUSCEPTIBLE
+    INFECTED = Simulation.INFECTED
+    RECOVERED = Simulation.RECOVERED
+    DEAD = Simulation.DEAD
+    STATUSES = Simulation.STATUSES
+
+    # Probabilities in use in a replicate (see update).
+    STARTING = 0
+    HEALTHCARE = 1
+    HEALTHCAP = 2
+
+    def __init__(self, width, height, recovery, infection, death,
+                 capacity, lockdown, infectionCap, deathCap, replicates=1,
+                 seed=None):
+        if lockdown != 0:
+            raise ValueError('The aggregate engine cannot model a lockdown '
+                             '(people stop moving), lockdown must be 0')
+        self.rng = np.random.default_rng(seed)
+        self.day = 0
+        self.width = width
+        self.height = height
+        self.replicates = replicates
+        self.recovery_probability = recovery
+        self.infection_probability_healthcare = infection
+        self.death_probability_healthcare = death
+        self.healthcare_capacity = capacity
+        self.lockdown_when_cases = lockdown
+        self.infection_probability_healthCap = infectionCap
+        self.death_probability_healthCap = deathCap
+
+        # Which probabilities each replicate uses: like in Simulation they
+        # start at 0 (STARTING) and are set by the capacity rule at the end
+        # of the first day.
+        self.probabilities = np.full(replicates, self.STARTING, np.int8)
+        self.infection_probabilities = np.array([0, infection, infectionCap])
+        self.death_probabilities = np.array([0, death, deathCap])
+        self.chance_table = None
+
+        self.counts = np.zeros((replicates, len(self.STATUSES)), np.int64)
+        self.counts[:, self.SPACE] = width * height
+
+        # Share of the cells with 3, 5 and 8 neighbours.
+        cells = width * height
+        corners = 4 if width > 1 and height > 1 else 0
+        interior = max(width - 2, 0) * max(height - 2, 0)
+        self.neighbourhoods = [(3, corners / cells),
+                               (5, (cells - interior - corners) / cells),
+                               (8, interior / cells)]
+
+    def population(self, num):
+        """Add num susceptible people to every replicate"""
+        if num > self.width * self.height:
+            raise ValueError('Cannot place %d people in %d empty cells'
+                             % (num, self.width * self.height))
+        self.counts[:, self.SPACE] -= num
+        self.counts[:, self.SUSCEPTIBLE] += num
+
+    def infect_randomly(self, num):
+        """Make num susceptible people infected in every replicate"""
+        if num > self.counts[:, self.SUSCEPTIBLE].min():
+            raise ValueError('Cannot infect %d people out of %d susceptible'
+                             % (num, self.counts[:, self.SUSCEPTIBLE].min()))
+        self.counts[:, self.SUSCEPTIBLE] -= num
+        self.counts[:, self.INFECTED] += num
+
+    def infection_chance(self, infected, beta):
+        """Chance that a susceptible person is infected in a day
+
+        infected is the number of infected people (an array) and beta the
+        infection probability.
+        """
+        cells = self.width * self.height
+        density = infected / max(cells - 1, 1)
+        chance = np.zeros(np.shape(density))
+        for neighbours, share in self.neighbourhoods:
+            if share == 0:
+                continue
+            # Binomial probabilities of k infected neighbours, k = 1.. .
+            for k in range(1, neighbours + 1):
+                binomial = (math.comb(neighbours, k) * density**k
+                            * (1 - density)**(neighbours - k))
+                chance += share * binomial * min(1, k * beta)
+        return chance
+
+    def get_chance_table(self):
+        """infection_chance for every number of infected and probabilities
+
+        The number of people never changes, so the table is computed once
+        and every day only needs a lookup per replicate.
+        """
+        people = int(self.counts[0].sum() - self.counts[0, self.SPACE])
+        if self.chance_table is None or self.chance_table.shape[1] <= people:
+            infected = np.arange(people + 1)
+            self.chance_table = np.stack([self.infection_chance(infected, beta)
+                                          for beta in self.infection_probabilities])
+        return self.chance_table
+
+    def update(self):
+        """Advance every replicate by one day"""
+        counts = self.counts
+        susceptible = counts[:, self.SUSCEPTIBLE]
+        infected = counts[:, self.INFECTED]
+
+        recovered = self.rng.binomial(infected, self.recovery_probability)
+        dead = self.rng.binomial(infected - recovered,
+                                 self.death_probabilities[self.probabilities])
+        chance = self.get_chance_table()[self.probabilities, infected]
+        newly_infected = self.rng.binomial(susceptible, chance)
+
+        counts[:, self.SUSCEPTIBLE] -= newly_infected
+        counts[:, self.INFECTED] += newly_infected - recovered - dead
+        counts[:, self.RECOVERED] += recovered
+        counts[:, self.DEAD] += dead
+
+        # The same capacity rule as Simulation.update.
+        count = counts[:, self.INFECTED]
+        if self.death_probability_healthCap:
+            if self.healthcare_capacity != 0:
+                self.probabilities[count > self.healthcare_capacity] = self.HEALTHCAP
+            if self.healthcare_capacity == 0:
+                self.probabilities[:] = self.HEALTHCARE
+            else:
+                self.probabilities[count < self.healthcare_capacity] = self.HEALTHCARE
+
+        self.day += 1
+
+    def get_counts_status(self):
+        """Dict giving number of people in each status
+
+        The numbers are ints with one replicate, otherwise arrays with the
+        number in every replicate.
+        """
+        counts = {}
+        for status, statusnum in self.STATUSES.items():
+            if self.replicates == 1:
+                counts[status] = int(self.counts[0, statusnum])
+            else:
+                counts[status] = self.counts[:, statusnum].copy()
+        return counts
+
+
+def make_aggregate(parameters, replicates, seed=None):
+    """AggregateSimulation for a parameters dict like run_ensemble takes
+
+    Arguments of Simulation that do not apply to counts (engine, movement
+    etc.) are ignored.
+    """
+    simulation = AggregateSimulation(parameters['width'], parameters['height'],
+        parameters['recovery'], parameters['infection'], parameters['death'],
+        parameters['capacity'], parameters['lockdown'],
+        parameters['infectionCap'], parameters['deathCap'],
+        replicates=replicates, seed=seed)
+    simulation.population(parameters['population'])
+    simulation.infect_randomly(parameters['cases'])
+    return simulation
+
+
+# Replicates advanced together in one worker, and the number of quantiles
+# of every day's counts each batch returns to be merged.
+BATCH_REPLICATES = 100000
+SKETCH_POINTS = 1001
+
+
+def run_aggregate_batch(job):
+    """Run one batch of aggregate replicates (called in the worker processes)
+
+    job is a tuple (seed, parameters, duration, replicates). Returns the sum
+    and sum of squares of the counts of every day and status and
+    SKETCH_POINTS evenly spaced quantiles of them.
+    """
+    seed, parameters, duration, replicates = job
+    simulation = make_aggregate(parameters, replicates, seed)
+    shape = (duration+1, len(Simulation.STATUSES))
+    total = np.zeros(shape)
+    squares = np.zeros(shape)
+    sketch = np.zeros(shape + (SKETCH_POINTS,))
+    ranks = np.linspace(0, replicates - 1, SKETCH_POINTS).round().astype(int)
+    for day in range(duration+1):
+        if day > 0:
+            simulation.update()
+        counts = simulation.counts
+        total[day] = counts.sum(axis=0)
+        squares[day] = (counts.astype(float)**2).sum(axis=0)
+        sketch[day] = np.sort(counts, axis=0)[ranks].T
+    return replicates, total, squares, sketch
+
+
+def merge_sketches(sizes, sketches, quantiles=QUANTILES):
+    """Quantiles of the union of batches from their sketches
+
+    Every point of a batch's sketch stands for the same share of its
+    replicates, so the quantiles are found in the weighted union of the
+    points (within about 1/SKETCH_POINTS of the exact rank).
+    """
+    points = np.concatenate(sketches, axis=-1)
+    weights = np.concatenate([np.full(sketch.shape[-1], size / sketch.shape[-1])
+                              for size, sketch in zip(sizes, sketches)])
+    order = np.argsort(points, axis=-1)
+    cumulative = np.cumsum(weights[order], axis=-1) / weights.sum()
+    result = []
+    for q in quantiles:
+        index = np.argmax(cumulative >= q - 1e-12, axis=-1)[..., None]
+        result.append(np.take_along_axis(np.take_along_axis(points, order, -1),
+                                         index, -1)[..., 0])
+    return np.stack(result, axis=-1)
+
+
+def run_aggregate(parameters, duration, replicates, workers=None, seed=None):
+    """Bands of replicates aggregate runs, like run_ensemble returns
+
+    Returns an array of shape (duration+1, len(Simulation.STATUSES),
+    len(BANDS)). The replicates are run in batches of BATCH_REPLICATES
+    spread over workers processes. The mean and standard deviation are
+    exact and the quantiles are merged from the sketch of each batch. The
+    batches and their seeds do not depend on workers.
+
+    Example
+    =======
+
+    >>> bands = run_aggregate(parameters, 365, replicates=1000000, workers=8)
+    >>> infected_median = bands[:, Simulation.INFECTED, BANDS.index('q50')]
+
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    batches = -(-replicates // BATCH_REPLICATES)
+    sizes = [len(batch) for batch in np.array_split(np.arange(replicates), batches)]
+    seeds = np.random.SeedSequence(seed).spawn(batches)
+    jobs = [(s, parameters, duration, size) for s, size in zip(seeds, sizes)]
+    if workers == 1 or batches == 1:
+        results = list(map(run_aggregate_batch, jobs))
+    else:
+        with Pool(min(workers, batches)) as pool:
+            results = pool.map(run_aggregate_batch, jobs)
+
+    total = sum(result[1] for result in results)
+    squares = sum(result[2] for result in results)
+    mean = total / replicates
+    bands = np.zeros(mean.shape + (len(BANDS),))
+    bands[..., 0] = mean
+    # Sample standard deviation, like RunningStats in model_ensemble.
+    if replicates > 1:
+        variance = (squares - replicates * mean**2) / (replicates - 1)
+        bands[..., 1] = np.sqrt(np.maximum(variance, 0))
+    bands[..., 2:] = merge_sketches(sizes, [result[3] for result in results])
+    return bands
+
+
+# Summaries of a run compared by validate_aggregate.
+SUMMARIES = ('peak infected', 'peak day', 'dead', 'recovered')
+
+
+def summarise(counts):
+    """Values of SUMMARIES for counts of shape (days, replicates, statuses)"""
+    infected = counts[:, :, Simulation.INFECTED]
+    return {
+        'peak infected': infected.max(axis=0),
+        'peak day': infected.argmax(axis=0),
+        'dead': counts[-1, :, Simulation.DEAD],
+        'recovered': counts[-1, :, Simulation.RECOVERED],
+    }
+
+
+def ks_statistic(a, b):
+    """Two-sample Kolmogorov-Smirnov statistic (largest gap between CDFs)"""
+    a, b = np.sort(a), np.sort(b)
+    values = np.concatenate([a, b])
+    cdf_a = np.searchsorted(a, values, side='right') / len(a)
+    cdf_b = np.searchsorted(b, values, side='right') / len(b)
+    return np.abs(cdf_a - cdf_b).max()
+
+
+def validate_aggregate(parameters, duration, replicates=100, workers=None,
+                       seed=0, aggregate_replicates=10000):
+    """Compare the aggregate engine with grid runs of the same parameters
+
+    Runs replicates grid simulations (in parallel, like run_ensemble) and
+    aggregate_replicates aggregate ones, and returns a dict mapping every
+    name in SUMMARIES to a dict with the mean and standard deviation of
+    that summary for both and the Kolmogorov-Smirnov statistic between
+    their distributions (0 means identical distributions).
+
+    Example
+    =======
+
+    >>> results = validate_aggregate(parameters, 365, replicates=200)
+    >>> results['dead']['ks']
+    0.06
+
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # Created first so that parameters it cannot model fail straight away.
+    seeds = np.random.SeedSequence(seed).spawn(replicates + 1)
+    simulation = make_aggregate(parameters, aggregate_replicates, seeds[-1])
+
+    jobs = [(s, parameters, duration) for s in seeds[:-1]]
+    if workers == 1:
+        grid = list(map(run_replicate, jobs))
+    else:
+        with Pool(workers) as pool:
+            grid = pool.map(run_replicate, jobs)
+    grid = np.stack(grid, axis=1)
+
+    aggregate = [simulation.counts.copy()]
+    for day in range(duration):
+        simulation.update()
+        aggregate.append(simulation.counts.copy())
+    aggregate = np.stack(aggregate)
+
+    grid, aggregate = summarise(grid), summarise(aggregate)
+    results = {}
+    for name in SUMMARIES:
+        results[name] = {
+            'grid mean': grid[name].mean(),
+            'grid std': grid[name].std(),
+            'aggregate mean': aggregate[name].mean(),
+            'aggregate std': aggregate[name].std(),
+            'ks': ks_statistic(grid[name], aggregate[name]),
+        }
+    return results
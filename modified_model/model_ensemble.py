@@ -0,0 +1,192 @@
+import numpy as np
+from multiprocessing import Pool
+import os
+
+from model_sir import Simulation
+
+
+# Bands stored for every day and status in the array returned by
+# run_ensemble. The q.. bands are the 5%, 50% and 95% quantiles.
+QUANTILES = (0.05, 0.5, 0.95)
+BANDS = ('mean', 'std') + tuple('q%02d' % round(100*q) for q in QUANTILES)
+
+
+class RunningStats:
+    """Running mean, variance and quantiles of a stream of arrays
+
+    Each call to add() folds one array (e.g. the counts of one replicate for
+    every day and status) into the statistics, so that memory does not depend
+    on the number of arrays added. The mean and variance use Welford's method
+    and the quantiles are estimated with the P-squared algorithm (Jain and
+    Chlamtac, 1985) applied elementwise.
+
+    Example
+    =======
+
+    >>> stats = RunningStats((366, 5))
+    >>> for counts in results:
+    ...     stats.add(counts)
+    >>> bands = stats.bands()   # shape (366, 5, len(BANDS))
+
+    """
+
+    def __init__(self, shape, quantiles=QUANTILES):
+        self.shape = tuple(shape)
+        self.quantiles = tuple(quantiles)
+        self.count = 0
+        self.mean = np.zeros(self.shape)
+        self.m2 = np.zeros(self.shape)
+
+        # P-squared state for each quantile: 5 marker heights, their actual
+        # positions, their desired positions and the desired increments.
+        self._first = []
+        self._heights = [None] * len(self.quantiles)
+        self._positions = [None] * len(self.quantiles)
+        self._desired = [None] * len(self.quantiles)
+        self._increments = [np.array([0, p/2, p, (1+p)/2, 1])
+                            for p in self.quantiles]
+
+    def add(self, x):
+        """Fold one array into the statistics"""
+        x = np.asarray(x, float)
+        self.count += 1
+
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+        # The P-squared markers are initialised from the first 5 arrays.
+        if self.count <= 5:
+            self._first.append(x)
+            if self.count == 5:
+                heights = np.sort(np.stack(self._first), axis=0)
+                self._first = []
+                for n, p in enumerate(self.quantiles):
+                    self._heights[n] = heights.copy()
+                    self._positions[n] = np.ones((5,) + self.shape)
+                    self._positions[n] *= np.arange(1, 6).reshape(
+                                                (5,) + (1,) * len(self.shape))
+                    self._desired[n] = 1 + 4 * self._increments[n]
+        else:
+            for n in range(len(self.quantiles)):
+                self._add_quantile(n, x)
+
+    def _add_quantile(self, n, x):
+        """P-squared update of the markers of quantile number n"""
+        q = self._heights[n]
+        pos = self._positions[n]
+        expand = (5,) + (1,) * len(self.shape)
+
+        # Cell k in which x falls, adjusting the extreme markers if needed.
+        q[0] = np.minimum(q[0], x)
+        q[4] = np.maximum(q[4], x)
+        k = np.count_nonzero(x >= q[1:4], axis=0)
+        pos += np.arange(5).reshape(expand) > k
+        self._desired[n] = self._desired[n] + self._increments[n]
+        desired = self._desired[n].reshape(expand)
+
+        # Move the middle markers towards their desired positions.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i in (1, 2, 3):
+                d = desired[i] - pos[i]
+                move = (((d >= 1) & (pos[i+1] - pos[i] > 1))
+                        | ((d <= -1) & (pos[i-1] - pos[i] < -1)))
+                if not move.any():
+                    continue
+                d = np.sign(d)
+                parabolic = q[i] + d / (pos[i+1] - pos[i-1]) * (
+                    (pos[i] - pos[i-1] + d) * (q[i+1] - q[i]) / (pos[i+1] - pos[i])
+                    + (pos[i+1] - pos[i] - d) * (q[i] - q[i-1]) / (pos[i] - pos[i-1]))
+                neighbour = np.where(d > 0, q[i+1], q[i-1])
+                neighbour_pos = np.where(d > 0, pos[i+1], pos[i-1])
+                linear = q[i] + d * (neighbour - q[i]) / (neighbour_pos - pos[i])
+                ok = (q[i-1] < parabolic) & (parabolic < q[i+1])
+                new = np.where(ok, parabolic, linear)
+                q[i] = np.where(move, new, q[i])
+                pos[i] = np.where(move, pos[i] + d, pos[i])
+
+    @property
+    def variance(self):
+        """Sample variance (zero until two arrays have been added)"""
+        if self.count < 2:
+            return np.zeros(self.shape)
+        return self.m2 / (self.count - 1)
+
+    def quantile(self, n):
+        """Estimate of quantile number n (see self.quantiles)"""
+        if self.count == 0:
+            return np.full(self.shape, np.nan)
+        if self.count < 5:
+            return np.quantile(np.stack(self._first), self.quantiles[n], axis=0)
+        return self._heights[n][2].copy()
+
+    def bands(self):
+        """Array of shape self.shape + (len(BANDS),) with all statistics"""
+        bands = [self.mean, np.sqrt(self.variance)]
+        bands += [self.quantile(n) for n in range(len(self.quantiles))]
+        return np.stack(bands, axis=-1)
+
+
+def run_replicate(job):
+    """Run one seeded simulation and return its counts for every day
+
+    job is a tuple (seed, parameters, duration) where parameters is a dict
+    with the arguments of Simulation plus 'population' and 'cases' and seed
+    is given to Simulation (e.g. a spawned np.random.SeedSequence). The
+    result has shape (duration+1, len(Simulation.STATUSES)).
+    """
+    seed, parameters, duration = job
+    parameters = dict(parameters)
+    population = parameters.pop('population')
+    cases = parameters.pop('cases')
+
+    simulation = Simulation(**parameters, seed=seed)
+    simulation.population(population)
+    simulation.infect_randomly(cases)
+
+    counts = np.zeros((duration+1, len(Simulation.STATUSES)), int)
+    counts[0] = list(simulation.get_counts_status().values())
+    for day in range(1, duration+1):
+        simulation.update()
+        counts[day] = list(simulation.get_counts_status().values())
+    return counts
+
+
+def run_ensemble(parameters, duration, replicates, workers=None, seed=None):
+    """Run replicates of a simulation in parallel and summarise their counts
+
+    Returns an array of shape (duration+1, len(Simulation.STATUSES),
+    len(BANDS)) with the mean, standard deviation and quantiles of the
+    number of people in each status on each day.
+
+    Example
+    =======
+
+    >>> parameters = dict(width=100, height=100, recovery=0.02,
+    ...                   infection=0.03, death=0.002, capacity=2000,
+    ...                   lockdown=600, infectionCap=0.05, deathCap=0.005,
+    ...                   population=6000, cases=2)
+    >>> bands = run_ensemble(parameters, 365, replicates=100, workers=4)
+    >>> infected_mean = bands[:, Simulation.INFECTED, BANDS.index('mean')]
+
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # Independent random streams for each replicate spawned from one seed.
+    seeds = np.random.SeedSequence(seed).spawn(replicates)
+    jobs = ((s, parameters, duration) for s in seeds)
+
+    stats = RunningStats((duration+1, len(Simulation.STATUSES)))
+    if workers == 1:
+        for counts in map(run_replicate, jobs):
+            stats.add(counts)
+    else:
+        with Pool(workers) as pool:
+            # The quantile estimates depend on the order the results are
+            # added in, so keep the order of the replicates (imap still
+            # hands them over one at a time).
+            for counts in pool.imap(run_replicate, jobs):
+                stats.add(counts)
+
+    return stats.bands()
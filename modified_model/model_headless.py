@@ -0,0 +1,50 @@
+import csv
+import sys
+
+import numpy as np
+
+
+def run_headless(simulation, duration, file=None, save_days=(),
+                 grid_file='grid_day{day}.npy'):
+    """Run a simulation without any plotting and write the results to files.
+
+    The number of people in each status is written as CSV (one row per day,
+    including day 0) to file, or to stdout if file is None. On each day in
+    save_days the grid state is also saved with numpy.save to
+    grid_file.format(day=day).
+
+    This module does not import matplotlib so that a run only costs the
+    simulation itself.
+
+    Example
+    =======
+
+    >>> sim = Simulation(100, 100, 0.02, 0.03, 0.002, 2000, 600, 0.05, 0.005)
+    >>> sim.population(6000)
+    >>> sim.infect_randomly(2)
+    >>> run_headless(sim, 365, 'counts.csv', save_days=[0, 100, 365])
+
+    """
+    save_days = set(save_days)
+    statuses = list(simulation.STATUSES)
+
+    if file is None:
+        outfile = sys.stdout
+    else:
+        outfile = open(file, 'w', newline='')
+
+    try:
+        writer = csv.writer(outfile)
+        writer.writerow(['day'] + statuses)
+
+        while True:
+            counts = simulation.get_counts_status()
+            writer.writerow([simulation.day] + [counts[s] for s in statuses])
+            if simulation.day in save_days:
+                np.save(grid_file.format(day=simulation.day), simulation.state)
+            if simulation.day >= duration:
+                break
+            simulation.update()
+    finally:
+        if file is not None:
+            outfile.close()
@@ -0,0 +1,236 @@
+import zipfile
+
+import numpy as np
+
+from model_sir import Simulation
+
+
+class HistoryRecorder:
+    """Record the grid of a simulation day by day in a single file
+
+    Each recorded day is stored either as a keyframe (the whole grid) or as
+    a delta against the day before (the flat indices of the cells that
+    changed and their new values). A keyframe is stored every
+    keyframe_interval days, and also whenever a delta would not be smaller
+    than the grid itself (e.g. with 'mix' movement, which moves everyone
+    every day). The file is a zip of .npy members like np.savez_compressed
+    writes, so every day can be read without reading the others.
+
+    Days must be recorded in order without gaps. The daily counts and the
+    parameters of the simulation are written when the recorder is closed.
+
+    Example
+    =======
+
+    >>> with HistoryRecorder('run.history.npz', sim) as recorder:
+    ...     recorder.record()
+    ...     for day in range(365):
+    ...         sim.update()
+    ...         recorder.record()
+
+    """
+
+    KEYFRAME = 0
+    DELTA = 1
+
+    def __init__(self, filename, simulation, keyframe_interval=30):
+        self.simulation = simulation
+        self.keyframe_interval = keyframe_interval
+        self.file = zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED,
+                                    allowZip64=True)
+        self.first_day = simulation.day
+        self.kinds = []
+        self.counts = []
+        self.previous = None
+        self.since_keyframe = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, name, array):
+        with self.file.open(name + '.npy', 'w', force_zip64=True) as member:
+            np.lib.format.write_array(member, np.asanyarray(array),
+                                      allow_pickle=False)
+
+    def record(self):
+        """Store the grid of the simulation's current day"""
+        simulation = self.simulation
+        expected = self.first_day + len(self.kinds)
+        if simulation.day != expected:
+            raise ValueError('Expected day %d to be recorded next, got day %d'
+                             % (expected, simulation.day))
+
+        state = np.array(simulation.state).reshape(-1)
+        name = 'day%06d' % simulation.day
+        changed = None
+        if self.previous is not None and self.since_keyframe < self.keyframe_interval:
+            changed = np.flatnonzero(state != self.previous)
+            # Every changed cell costs 5 bytes (gap and value) against 1
+            # byte per cell for a keyframe.
+            if 5 * len(changed) >= state.size:
+                changed = None
+
+        if changed is None:
+            self.write(name, state.reshape(simulation.state.shape))
+            self.kinds.append(self.KEYFRAME)
+            self.since_keyframe = 0
+        else:
+            # Gaps between the changed indices are small numbers, which
+            # compress much better than the indices themselves.
+            gaps = np.diff(changed, prepend=0).astype(np.uint32)
+            self.write(name + '_gaps', gaps)
+            self.write(name + '_values', state[changed])
+            self.kinds.append(self.DELTA)
+            self.since_keyframe += 1
+
+        self.counts.append(np.array(simulation.counts, np.int64))
+        self.previous = state
+
+    def close(self):
+        """Write the index, counts and parameters and close the file"""
+        if self.file is None:
+            return
+        simulation = self.simulation
+        self.write('first_day', np.array(self.first_day))
+        self.write('kinds', np.array(self.kinds, np.uint8))
+        self.write('counts', np.array(self.counts, np.int64).reshape(
+                   -1, len(simulation.STATUSES)))
+        for name, attribute in simulation.PARAMETERS.items():
+            self.write('param_' + name, np.array(getattr(simulation, attribute)))
+        self.file.close()
+        self.file = None
+
+
+def record_history(simulation, duration, filename, keyframe_interval=30):
+    """Run a simulation up to day duration recording every day to filename
+
+    Example
+    =======
+
+    >>> record_history(sim, 365, 'run.history.npz')
+    >>> history = History('run.history.npz')
+
+    """
+    with HistoryRecorder(filename, simulation, keyframe_interval) as recorder:
+        recorder.record()
+        while simulation.day < duration:
+            simulation.update()
+            recorder.record()
+
+
+class History:
+    """Random access to the days of a run saved by HistoryRecorder
+
+    grid(day) rebuilds the grid of any recorded day from the closest
+    keyframe before it. The last grid rebuilt is kept so that reading the
+    days in order only applies one delta per day. counts is an array of
+    shape (days, len(Simulation.STATUSES)) with the counts of every day.
+
+    Example
+    =======
+
+    >>> history = History('run.history.npz')
+    >>> grid = history.grid(200)
+    >>> infected = history.counts[:, Simulation.INFECTED]
+
+    """
+
+    def __init__(self, filename):
+        self.data = np.load(filename)
+        self.first_day = self.data['first_day'].item()
+        self.kinds = self.data['kinds']
+        self.counts = self.data['counts']
+        self.last_day = self.first_day + len(self.kinds) - 1
+        self.keyframes = np.flatnonzero(self.kinds == HistoryRecorder.KEYFRAME)
+        self.parameters = {name: self.data['param_' + name].item()
+                           for name in Simulation.PARAMETERS}
+        self.cached_day = None
+        self.cached_grid = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.data.close()
+
+    @property
+    def days(self):
+        return range(self.first_day, self.last_day + 1)
+
+    def population(self):
+        """Number of people (cells that are not space) in the recording"""
+        return int(self.counts[0].sum() - self.counts[0][Simulation.SPACE])
+
+    def grid(self, day):
+        """The grid on a recorded day (a new array)"""
+        return self.rebuild(day).copy()
+
+    def rebuild(self, day):
+        """The grid on a recorded day, in the cache (do not modify it)"""
+        if day not in self.days:
+            raise IndexError('Day %d was not recorded (days %d to %d are)'
+                             % (day, self.first_day, self.last_day))
+        index = day - self.first_day
+        keyframe = self.keyframes[np.searchsorted(self.keyframes, index,
+                                                  side='right') - 1]
+
+        # Continue from the cached grid if it is between the keyframe and
+        # day, otherwise start again from the keyframe.
+        if (self.cached_day is not None and
+                keyframe <= self.cached_day - self.first_day <= index):
+            start = self.cached_day - self.first_day
+            grid = self.cached_grid
+        else:
+            start = keyframe
+            grid = self.data['day%06d' % (self.first_day + keyframe)]
+
+        flat = grid.reshape(-1)
+        for n in range(start + 1, index + 1):
+            name = 'day%06d' % (self.first_day + n)
+            if self.kinds[n] == HistoryRecorder.KEYFRAME:
+                grid = self.data[name]
+                flat = grid.reshape(-1)
+            else:
+                changed = np.cumsum(self.data[name + '_gaps'], dtype=np.int64)
+                flat[changed] = self.data[name + '_values']
+
+        self.cached_day = day
+        self.cached_grid = grid
+        return grid
+
+    def replay(self, day=None):
+        """Replay simulation starting on day (default: the first day)"""
+        return Replay(self, day)
+
+
+class Replay(Simulation):
+    """Simulation that plays back a History instead of computing each day
+
+    update() moves on to the next recorded day, so plot_simulation,
+    Animation and run_headless work on a replay just as on the simulation
+    that was recorded. After the last recorded day update() does nothing.
+    """
+
+    def __init__(self, history, day=None):
+        parameters = dict(history.parameters, storage='memory')
+        super().__init__(**parameters)
+        self.history = history
+        self.seek(history.first_day if day is None else day)
+
+    def seek(self, day):
+        """Jump to a recorded day (clamped to the recorded days)"""
+        day = min(max(day, self.history.first_day), self.history.last_day)
+        self.state = self.history.grid(day)
+        self.counts = self.history.counts[day - self.history.first_day].copy()
+        self.day = day
+        self.infected_cells = None
+
+    def update(self):
+        if self.day < self.history.last_day:
+            self.seek(self.day + 1)
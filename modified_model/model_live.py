@@ -0,0 +1,190 @@
+import asyncio
+import json
+import threading
+import time
+
+from model_profile import Profiler
+
+
+class LiveServer:
+    """Local HTTP server streaming the progress of a simulation
+
+    The server runs an asyncio event loop in a background thread, so the
+    simulation keeps running in its own thread and publish() never waits
+    for the network. Clients can request:
+
+        /events   a stream of Server-Sent Events, one JSON record per day
+        /latest   the latest record as JSON
+
+    Every client only keeps the latest record it has not sent yet, so a
+    slow client skips days instead of holding anything up.
+
+    Example
+    =======
+
+    >>> server = LiveServer(port=8000)
+    >>> server.publish({'day': 1, 'counts': {'infected': 3}})
+    >>> server.close()
+
+    $ curl -N http://127.0.0.1:8000/events
+
+    """
+
+    def __init__(self, host='127.0.0.1', port=8000):
+        self.host = host
+        self.port = port
+        self.latest = None
+        self.clients = set()
+        self.closing = False
+        self.error = None
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(started,),
+                                       daemon=True)
+        self.thread.start()
+        started.wait()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self, started):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port))
+            # Port 0 picks a free port; report the one actually used.
+            self.port = self.server.sockets[0].getsockname()[1]
+        except OSError as error:
+            self.error = error
+            started.set()
+            return
+        started.set()
+        self.loop.run_forever()
+
+        # Stopped by close(): let the streams to the clients end.
+        self.server.close()
+        tasks = asyncio.all_tasks(self.loop)
+        if tasks:
+            self.loop.run_until_complete(asyncio.wait(tasks, timeout=1))
+        self.loop.close()
+
+    def publish(self, record):
+        """Send record (a dict that can be JSON encoded) to every client"""
+        data = json.dumps(record)
+        try:
+            self.loop.call_soon_threadsafe(self._broadcast, data)
+        except RuntimeError:
+            # The server has been closed.
+            pass
+
+    def close(self):
+        """Stop the server (clients see the end of the stream)"""
+        if self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self._stop)
+            self.thread.join()
+
+    def _stop(self):
+        self.closing = True
+        for client in self.clients:
+            client.ready.set()
+        self.loop.stop()
+
+    def _broadcast(self, data):
+        self.latest = data
+        for client in self.clients:
+            # Replaces a record the client has not sent yet.
+            client.data = data
+            client.ready.set()
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            # Skip the headers of the request.
+            while (await reader.readline()).strip():
+                pass
+            parts = request.decode('latin-1').split()
+            path = parts[1] if len(parts) > 1 else '/'
+            if path.startswith('/events'):
+                await self._stream(writer)
+            elif path.startswith('/latest'):
+                body = (self.latest or 'null').encode()
+                writer.write(b'HTTP/1.1 200 OK\r\n'
+                             b'Content-Type: application/json\r\n'
+                             b'Content-Length: %d\r\n'
+                             b'Connection: close\r\n\r\n' % len(body) + body)
+                await writer.drain()
+            else:
+                writer.write(b'HTTP/1.1 404 Not Found\r\n'
+                             b'Content-Length: 0\r\n'
+                             b'Connection: close\r\n\r\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _stream(self, writer):
+        writer.write(b'HTTP/1.1 200 OK\r\n'
+                     b'Content-Type: text/event-stream\r\n'
+                     b'Cache-Control: no-cache\r\n'
+                     b'Connection: close\r\n\r\n')
+        # Only a small buffer, so records for a slow client are replaced
+        # by newer ones instead of queueing up.
+        writer.transport.set_write_buffer_limits(high=4096)
+        client = _Client(self.latest)
+        self.clients.add(client)
+        try:
+            while True:
+                await client.ready.wait()
+                client.ready.clear()
+                if self.closing:
+                    break
+                writer.write(b'data: ' + client.data.encode() + b'\n\n')
+                await writer.drain()
+        finally:
+            self.clients.discard(client)
+
+
+class _Client:
+    """Latest record waiting to be sent to one /events client"""
+
+    def __init__(self, data):
+        self.data = data
+        self.ready = asyncio.Event()
+        if data is not None:
+            self.ready.set()
+
+
+class LiveProfiler(Profiler):
+    """Profiler that also publishes every step to a LiveServer
+
+    counts is a function returning the counts of the simulation as a dict
+    (e.g. count_states of the particle model). It should not use this
+    profiler itself, or its own time is included in every record. Each
+    record has the step (day),
+    the counts, the seconds since the previous step and the seconds spent
+    in each phase of the step.
+
+    Example
+    =======
+
+    >>> server = LiveServer(port=8000)
+    >>> sim.profiler = LiveProfiler(server, sim.count_states)
+
+    """
+
+    def __init__(self, server, counts, trace_file=None):
+        super().__init__(trace_file)
+        self.server = server
+        self.counts = counts
+        self.last = time.perf_counter()
+
+    def end_step(self, step):
+        now = time.perf_counter()
+        self.server.publish({
+            'step': step,
+            'counts': self.counts(),
+            'step_seconds': now - self.last,
+            'phase_seconds': self.step,
+        })
+        self.last = now
+        super().end_step(step)
@@ -0,0 +1,236 @@
+import multiprocessing
+import os
+
+import numpy as np
+
+from model_sir import Simulation
+
+
+# People with these statuses travel between regions (not the dead).
+TRAVELLING = (Simulation.SUSCEPTIBLE, Simulation.INFECTED, Simulation.RECOVERED)
+
+
+class RegionGroup:
+    """Some of the regions of a Metapopulation, stepped by one worker
+
+    regions is a list of (index, seed, parameters) where parameters is a
+    dict with the arguments of Simulation plus 'population' and 'cases'
+    (like for model_ensemble.run_replicate) and mobility is the whole
+    mobility matrix of the Metapopulation.
+    """
+
+    def __init__(self, regions, mobility):
+        self.indices = [index for index, _, _ in regions]
+        self.simulations = []
+        for index, seed, parameters in regions:
+            parameters = dict(parameters)
+            population = parameters.pop('population')
+            cases = parameters.pop('cases')
+            simulation = Simulation(**parameters, seed=seed)
+            simulation.population(population)
+            simulation.infect_randomly(cases)
+            self.simulations.append(simulation)
+        self.mobility = mobility
+
+    def counts(self):
+        return np.array([simulation.counts for simulation in self.simulations])
+
+    def depart(self):
+        """Advance every region by a day and take out the travellers
+
+        Returns (departures, space) where departures[n, b, s] is the number
+        of people with status s leaving the n-th region of this group for
+        region b and space[n] is the number of empty cells that region had
+        before they left.
+        """
+        regions = len(self.mobility)
+        departures = np.zeros((len(self.simulations), regions,
+                               len(Simulation.STATUSES)), np.int64)
+        space = np.zeros(len(self.simulations), np.int64)
+        for n, (index, simulation) in enumerate(zip(self.indices,
+                                                    self.simulations)):
+            simulation.update()
+            space[n] = simulation.counts[Simulation.SPACE]
+
+            rates = self.mobility[index]
+            leaving = rates.sum()
+            if leaving == 0:
+                continue
+            for status in TRAVELLING:
+                # Each person leaves with probability leaving and then
+                # picks a destination in proportion to the rates.
+                number = simulation.rng.binomial(simulation.counts[status],
+                                                 min(leaving, 1))
+                if number == 0:
+                    continue
+                departures[n, :, status] = simulation.rng.multinomial(
+                    number, rates / leaving)
+                simulation.change_randomly(status, Simulation.SPACE, number)
+            simulation.infected_cells = None
+        return departures, space
+
+    def arrive(self, arrivals):
+        """Put arrivals[n, s] people with status s in the n-th region"""
+        for simulation, numbers in zip(self.simulations, arrivals):
+            for status in TRAVELLING:
+                if numbers[status]:
+                    simulation.change_randomly(Simulation.SPACE, status,
+                                               numbers[status])
+            simulation.infected_cells = None
+        return self.counts()
+
+
+def _serve(connection, regions, mobility):
+    """Worker process: run the commands sent by a Metapopulation"""
+    group = RegionGroup(regions, mobility)
+    connection.send(group.counts())
+    while True:
+        command, argument = connection.recv()
+        if command == 'depart':
+            connection.send(group.depart())
+        elif command == 'arrive':
+            connection.send(group.arrive(argument))
+        else:
+            break
+    connection.close()
+
+
+class Metapopulation:
+    """Many regions, each a Simulation on its own grid, with travel
+
+    regions is a list of dicts with the arguments of Simulation plus
+    'population' and 'cases', so every region has its own size, capacity,
+    lockdown threshold etc. mobility[a, b] is the probability that a person
+    in region a travels to region b on a day (the diagonal is ignored).
+
+    Every day each region is advanced with Simulation.update, then the
+    travellers leave their grid and are put in random empty cells of their
+    destination. A region takes in at most as many travellers as it had
+    empty cells before its own travellers left; the others go back home.
+
+    The regions are split between workers processes which keep their
+    grids, so only the numbers of travellers and the counts are sent
+    between processes. workers=1 runs everything in this process.
+
+    Example
+    =======
+
+    >>> regions = [dict(parameters, cases=10 if n == 0 else 0)
+    ...            for n in range(200)]
+    >>> mobility = np.full((200, 200), 0.001 / 199)
+    >>> with Metapopulation(regions, mobility, workers=8, seed=1) as country:
+    ...     for day in range(365):
+    ...         country.update()
+    ...     print(country.get_counts_status())
+    ...     print(country.get_region_counts_status(0))
+
+    """
+
+    STATUSES = Simulation.STATUSES
+
+    def __init__(self, regions, mobility, workers=None, seed=None):
+        mobility = np.array(mobility, float)
+        if mobility.shape != (len(regions), len(regions)):
+            raise ValueError('mobility must be a %d x %d matrix'
+                             % (len(regions), len(regions)))
+        np.fill_diagonal(mobility, 0)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = max(1, min(workers, len(regions)))
+
+        self.day = 0
+        self.mobility = mobility
+        seeds = np.random.SeedSequence(seed).spawn(len(regions) + 1)
+        self.rng = np.random.default_rng(seeds[-1])
+
+        # Contiguous blocks of regions for each worker.
+        jobs = [(index, seeds[index], parameters)
+                for index, parameters in enumerate(regions)]
+        blocks = np.array_split(np.arange(len(regions)), workers)
+        self.blocks = [block for block in blocks if len(block)]
+
+        self.group = None
+        self.connections = []
+        self.processes = []
+        if workers == 1:
+            self.group = RegionGroup(jobs, mobility)
+            self.counts = self.group.counts()
+        else:
+            for block in self.blocks:
+                ours, theirs = multiprocessing.Pipe()
+                process = multiprocessing.Process(target=_serve, daemon=True,
+                    args=(theirs, [jobs[index] for index in block], mobility))
+                process.start()
+                self.connections.append(ours)
+                self.processes.append(process)
+            self.counts = np.concatenate([connection.recv()
+                                          for connection in self.connections])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop the worker processes"""
+        for connection in self.connections:
+            connection.send(('stop', None))
+            connection.close()
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
+
+    def run(self, command, arguments=None):
+        """Send command to every worker (all at once) and collect the results"""
+        if arguments is None:
+            arguments = [None] * len(self.blocks)
+        if self.group is not None:
+            method = getattr(self.group, command)
+            return [method() if arguments[0] is None else method(arguments[0])]
+        for connection, argument in zip(self.connections, arguments):
+            connection.send((command, argument))
+        return [connection.recv() for connection in self.connections]
+
+    def update(self):
+        """Advance every region by one day and move the travellers"""
+        results = self.run('depart')
+        departures = np.concatenate([d for d, _ in results])
+        space = np.concatenate([s for _, s in results])
+
+        arrivals = self.route(departures, space)
+        self.counts = np.concatenate(self.run('arrive',
+            [arrivals[block] for block in self.blocks]))
+        self.day += 1
+
+    def route(self, departures, space):
+        """People put in each region given departures[a, b, s] (see depart)
+
+        Travellers that do not fit in their destination are sent back.
+        """
+        regions, statuses = len(space), departures.shape[-1]
+        arrivals = np.zeros((regions, statuses), np.int64)
+        for b in range(regions):
+            incoming = departures[:, b, :]
+            total = incoming.sum()
+            if total <= space[b]:
+                arrivals[b] += incoming.sum(axis=0)
+                continue
+            # Choose the travellers that fit at random, the rest go home.
+            accepted = self.rng.multivariate_hypergeometric(
+                incoming.ravel(), space[b]).reshape(incoming.shape)
+            arrivals[b] += accepted.sum(axis=0)
+            arrivals += incoming - accepted
+        return arrivals
+
+    def get_region_counts_status(self, region):
+        """Dict giving number of people in each status in one region"""
+        return {status: int(self.counts[region, statusnum])
+                for status, statusnum in self.STATUSES.items()}
+
+    def get_counts_status(self):
+        """Dict giving number of people in each status in all regions"""
+        total = self.counts.sum(axis=0)
+        return {status: int(total[statusnum])
+                for status, statusnum in self.STATUSES.items()}
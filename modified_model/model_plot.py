@@ -30,6 +30,9 @@ def plot_simulation(simulation, duration):
     days = [(duration * i) // (N - 1) for i in range(N)]
 
     for ax, day in zip(axes, days):
+        if hasattr(simulation, 'seek'):
+            # A recorded run (model_history.Replay) can jump to the day.
+            simulation.seek(day)
         while simulation.day < day:
             simulation.update()
         rgb_matrix = simulation.get_rgb_matrix()
@@ -41,3 +44,38 @@ def plot_simulation(simulation, duration):
     # Return the figure. The caller of this function can decide whether to use
     # show (screen) or savefig (file).
     return fig
+
+
+def plot_ensemble(bands, simulation):
+    """Produce a plot of the per-day bands returned by run_ensemble.
+
+    Each status is shown as its median line with the 5%-95% quantile range
+    shaded around it, using the colours of the simulation's COLOURMAP.
+
+    Example
+    =======
+
+    >>> bands = run_ensemble(parameters, 365, replicates=100)
+    >>> fig = plot_ensemble(bands, Simulation)
+    >>> plt.show()
+
+    """
+    from model_ensemble import BANDS
+
+    fig = plt.figure()
+    ax = fig.add_subplot(1, 1, 1)
+    days = range(bands.shape[0])
+
+    # Skip "space" as it never changes.
+    for status, statusnum in list(simulation.STATUSES.items())[1:]:
+        colour = simulation.COLOURMAP[status]
+        low = bands[:, statusnum, BANDS.index('q05')]
+        median = bands[:, statusnum, BANDS.index('q50')]
+        high = bands[:, statusnum, BANDS.index('q95')]
+        ax.fill_between(days, low, high, color=colour, alpha=0.3)
+        ax.plot(days, median, color=colour, label=status, linewidth=2)
+
+    ax.legend(prop={'size': 'x-small'}, loc='upper right')
+    ax.set_xlabel('days')
+    ax.set_ylabel('Number of people', rotation=90)
+    return fig
@@ -0,0 +1,107 @@
+import contextlib
+import json
+import time
+
+
+class Profiler:
+    """Collect the wall time spent in each phase of a simulation step
+
+    The simulations wrap each phase of their step in profiler.phase(name,
+    items) where items is the amount of work done (e.g. cells or pairs
+    processed) and call profiler.end_step(step) at the end of every step.
+    If trace_file is given, one JSON line per step with the time of each
+    phase is written to it.
+
+    Example
+    =======
+
+    >>> sim.profiler = Profiler('trace.jsonl')
+    >>> for day in range(100):
+    ...     sim.update()
+    >>> print(sim.profiler.summary())
+
+    """
+
+    enabled = True
+
+    def __init__(self, trace_file=None):
+        self.total = {}
+        self.calls = {}
+        self.items = {}
+        self.step = {}
+        self.step_items = {}
+        self.steps = 0
+        self.trace = open(trace_file, 'w') if trace_file is not None else None
+
+    @contextlib.contextmanager
+    def phase(self, name, items=0):
+        """Time the code inside a with block as phase name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.total[name] = self.total.get(name, 0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self.step[name] = self.step.get(name, 0) + seconds
+            self.add_items(name, items)
+
+    def add_items(self, name, items):
+        """Add to the amount of work done in phase name"""
+        self.items[name] = self.items.get(name, 0) + int(items)
+        self.step_items[name] = self.step_items.get(name, 0) + int(items)
+
+    def end_step(self, step):
+        """Finish a step, writing its phase times to the trace"""
+        self.steps += 1
+        if self.trace is not None:
+            record = {'step': step, 'seconds': self.step,
+                      'items': self.step_items}
+            self.trace.write(json.dumps(record) + '\n')
+        self.step = {}
+        self.step_items = {}
+
+    def close(self):
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+
+    def summary(self):
+        """Table of the time spent in each phase, slowest first"""
+        overall = sum(self.total.values()) or 1
+        steps = self.steps or 1
+        lines = ['%-20s %8s %10s %12s %7s %14s %14s'
+                 % ('phase', 'calls', 'total s', 'ms per step', 'share',
+                    'items', 'items per s')]
+        for name in sorted(self.total, key=self.total.get, reverse=True):
+            total = self.total[name]
+            rate = self.items[name] / total if total else 0
+            lines.append('%-20s %8d %10.3f %12.3f %6.1f%% %14d %14.0f'
+                         % (name, self.calls[name], total,
+                            1000 * total / steps, 100 * total / overall,
+                            self.items[name], rate))
+        lines.append('%d steps, %.3f s in total' % (self.steps, overall))
+        return '\n'.join(lines)
+
+
+class NullProfiler:
+    """Profiler that does nothing, used when profiling is switched off"""
+
+    enabled = False
+
+    _nothing = contextlib.nullcontext()
+
+    def phase(self, name, items=0):
+        return self._nothing
+
+    def add_items(self, name, items):
+        pass
+
+    def end_step(self, step):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
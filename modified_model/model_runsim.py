@@ -1,12 +1,36 @@
 import argparse
+import atexit
+import sys
 
-import matplotlib.pyplot as plt
+import numpy as np
 
 from model_sir import Simulation
-from model_animation import Animation, LineAnimation
-from model_plot import plot_simulation
+from model_ensemble import run_ensemble
+from model_aggregate import run_aggregate, validate_aggregate
+from model_headless import run_headless
+from model_sweep import run_sweep, parse_range, SWEEP_PARAMETERS
+from model_profile import Profiler
+from model_live import LiveServer, LiveProfiler
+from model_history import History, record_history
+from model_video import export_video
+from model_metapop import Metapopulation
 
-from model_animation import get_ylim
+# Defaults of the options that --resume can change (see main).
+RESUME_DEFAULTS = {
+    'recovery': 0.02,
+    'infection': 0.03,
+    'death': 0.002,
+    'deathCap': 0.005,
+    'infectionCap': 0.05,
+    'capacity': 2000,
+    'lockdown': 600,
+    'engine': 'numpy',
+    'movement': 'mix',
+    'distance': 1,
+}
+
+# NOTE: matplotlib (and the modules using it) are only imported when a plot
+# or animation is requested so that --headless runs never load it.
 
 
 def main(*args):
@@ -14,8 +38,21 @@ def main(*args):
 
     $ python runsim_model.py                        # show animation on screen
     $ python runsim_model.py --file=video.mp4       # save animation to video
+    $ python runsim_model.py --raw-video --scale=2 --file=video.mp4  # grid only, fast
     $ python runsim_model.py --plot                 # show plot on screen
     $ python runsim_model.py --plot --file=plot.pdf # save plot to pdf
+    $ python runsim_model.py --replicates=100       # plot bands of 100 runs
+    $ python runsim_model.py --replicates=100 --file=bands.npy
+    $ python runsim_model.py --replicates=1000000 --aggregate --lockdown=0
+    $ python runsim_model.py --validate --replicates=200 --lockdown=0
+    $ python runsim_model.py --headless --file=counts.csv --save-days=0,365
+    $ python runsim_model.py --headless --duration=100 --checkpoint=day100.npz
+    $ python runsim_model.py --resume=day100.npz --lockdown=100
+    $ python runsim_model.py --sweep lockdown=0,300,600 --sweep infection=0.01:0.05:0.01 --file=sweep.npy
+    $ python runsim_model.py --regions=100 --travel=0.01 --file=counts.csv
+    $ python runsim_model.py --headless --live=8000   # watch http://127.0.0.1:8000/events
+    $ python runsim_model.py --headless --record=run.history.npz
+    $ python runsim_model.py --replay=run.history.npz --plot
 
     """
     #
@@ -26,37 +63,288 @@ def main(*args):
                         help='Use a N x N simulation grid')
     parser.add_argument('--duration', metavar='T', type=int, default=365,
                         help='Simulate for T days')
-    parser.add_argument('--recovery', metavar='P', type=float, default=0.02,
+    parser.add_argument('--recovery', metavar='P', type=float, default=None,
                         help='Probability of recovery (per day)')
-    parser.add_argument('--infection', metavar='P', type=float, default=0.03,
+    parser.add_argument('--infection', metavar='P', type=float, default=None,
                         help='Probability of infecting a neighbour (per day)')
-    parser.add_argument('--death', metavar='P', type=float, default=0.002,
+    parser.add_argument('--death', metavar='P', type=float, default=None,
                         help='Probability of dying when infected (per day)')
-    parser.add_argument('--deathCap', metavar='P', type=float, default=0.005,
+    parser.add_argument('--deathCap', metavar='P', type=float, default=None,
                         help='Probability of dying when healthcare capacity is reached')
-    parser.add_argument('--infectionCap', metavar='P', type=float, default=0.05,
+    parser.add_argument('--infectionCap', metavar='P', type=float, default=None,
                         help='Probability of infection when healthcare capacity is reached')
     parser.add_argument('--population', metavar='N', type=int, default=6000,
                         help='The size of the population')
     parser.add_argument('--cases', metavar='N', type=int, default=2,
                         help='Number of initial infected people')
-    parser.add_argument('--capacity', metavar='N', type=int, default=2000,
+    parser.add_argument('--capacity', metavar='N', type=int, default=None,
                         help='Hospitals healthcare capacity. 0 if unlimited capacity.')
-    parser.add_argument('--lockdown', metavar='N', type=int, default=600,
+    parser.add_argument('--lockdown', metavar='N', type=int, default=None,
                         help='Lockdown when cases reach a value. 0 if no lockdown at all.')
+    parser.add_argument('--engine', choices=Simulation.ENGINES, default=None,
+                        help='Update every cell in Python (cell), the whole grid at once (numpy) or only cells near infected people (sparse)')
+    parser.add_argument('--movement', choices=Simulation.MOVEMENTS, default=None,
+                        help='Move people anywhere in the grid (mix) or only nearby (local)')
+    parser.add_argument('--distance', metavar='N', type=int, default=None,
+                        help='With --movement=local, how far people can move in a day')
+    parser.add_argument('--memmap', metavar='DIR', type=str, default=None,
+                        help='Keep the grid in memory-mapped files in DIR (for grids larger than RAM)')
+    parser.add_argument('--seed', metavar='N', type=int, default=None,
+                        help='Seed for the random numbers, for reproducible runs')
     parser.add_argument('--plot', action='store_true',
                         help='Generate plots instead of an animation')
+    parser.add_argument('--replicates', metavar='N', type=int, default=1,
+                        help='Run N independent simulations and summarise them')
+    parser.add_argument('--aggregate', action='store_true',
+                        help='With --replicates, simulate counts only assuming a well mixed grid (much faster)')
+    parser.add_argument('--validate', action='store_true',
+                        help='Compare --replicates grid runs with the --aggregate engine and print the result')
+    parser.add_argument('--workers', metavar='K', type=int, default=None,
+                        help='Number of processes used for --replicates, --sweep and --regions (default: all cores)')
+    parser.add_argument('--regions', metavar='N', type=int, default=1,
+                        help='Simulate N regions, each with its own grid, with people travelling between them')
+    parser.add_argument('--travel', metavar='P', type=float, default=0.01,
+                        help='With --regions, probability of travelling to another region (per day)')
+    parser.add_argument('--headless', action='store_true',
+                        help='Only run the simulation and write the daily counts as CSV (no matplotlib)')
+    parser.add_argument('--save-days', metavar='D1,D2,...', type=str, default='',
+                        help='With --headless, also save the grid on these days')
+    parser.add_argument('--grid-file', metavar='PATTERN', type=str,
+                        default='grid_day{day}.npy',
+                        help='With --save-days, filename pattern for the saved grids')
+    parser.add_argument('--sweep', metavar='NAME=VALUES', action='append', default=[],
+                        help='Run every combination of these values (v1,v2,... or start:stop:step) '
+                             'of ' + ', '.join(SWEEP_PARAMETERS))
+    parser.add_argument('--cache', metavar='DIR', type=str, default='sweep_cache',
+                        help='With --sweep, directory where the results of each run are cached')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time each phase of the simulation step and print a summary at exit')
+    parser.add_argument('--profile-trace', metavar='FILE', type=str, default=None,
+                        help='With --profile, also write the phase times of every day as JSON lines')
+    parser.add_argument('--live', metavar='PORT', type=int, default=None,
+                        help='Stream the counts and step times of every day on http://127.0.0.1:PORT/events')
+    parser.add_argument('--checkpoint', metavar='FILE', type=str, default=None,
+                        help='Save the simulation to FILE at the end of the run')
+    parser.add_argument('--resume', metavar='FILE', type=str, default=None,
+                        help='Continue a simulation saved with --checkpoint up to day --duration')
+    parser.add_argument('--record', metavar='FILE', type=str, default=None,
+                        help='Record every day of the run to FILE (see model_history) and show it from there')
+    parser.add_argument('--replay', metavar='FILE', type=str, default=None,
+                        help='Show a run saved with --record instead of simulating')
+    parser.add_argument('--raw-video', action='store_true',
+                        help='With --file, pipe the grid straight to ffmpeg (much faster, no line plot)')
+    parser.add_argument('--scale', metavar='N', type=int, default=1,
+                        help='With --raw-video, draw every cell as N x N pixels')
     parser.add_argument('--file', metavar='N', type=str, default=None,
                         help='Filename to save to instead of showing on screen')
     args = parser.parse_args(args)
 
+    # The parameters --resume can change default to None so that only the
+    # ones given on the command line are applied to a checkpoint.
+    given = {option for option in RESUME_DEFAULTS
+             if getattr(args, option) is not None}
+    for option, value in RESUME_DEFAULTS.items():
+        if option not in given:
+            setattr(args, option, value)
+
+    if args.replay is not None and (args.resume is not None or args.checkpoint is not None):
+        parser.error('--replay cannot be used with --resume or --checkpoint')
+    if (args.aggregate or args.validate) and args.lockdown != 0:
+        parser.error('--aggregate and --validate need --lockdown=0 (the '
+                     'aggregate engine cannot model a lockdown)')
+
+    parameters = dict(width=args.size, height=args.size,
+                      recovery=args.recovery, infection=args.infection,
+                      death=args.death, capacity=args.capacity,
+                      lockdown=args.lockdown,
+                      infectionCap=args.infectionCap,
+                      deathCap=args.deathCap, engine=args.engine,
+                      movement=args.movement,
+                      movement_distance=args.distance,
+                      population=args.population, cases=args.cases)
+
+    if args.sweep:
+        #  python model_runsim.py --sweep lockdown=0,300,600 --file=sweep.npy
+        ranges = {}
+        for sweep in args.sweep:
+            name, values = sweep.split('=', 1)
+            if name not in SWEEP_PARAMETERS:
+                parser.error('cannot sweep %r, choose from %s'
+                             % (name, ', '.join(SWEEP_PARAMETERS)))
+            ranges[name] = parse_range(values, SWEEP_PARAMETERS[name])
+        seed = 0 if args.seed is None else args.seed
+        counts = run_sweep(parameters, ranges, args.duration, seed=seed,
+                           workers=args.workers, cache_dir=args.cache)
+        if args.file is None:
+            # Short summary of every point of the sweep.
+            for index in np.ndindex(*counts.shape[:-2]):
+                point = ' '.join('%s=%s' % (name, ranges[name][n])
+                                 for name, n in zip(ranges, index))
+                infected = counts[index][:, Simulation.INFECTED]
+                dead = counts[index][-1, Simulation.DEAD]
+                print('%s: peak infected %d on day %d, dead %d'
+                      % (point, infected.max(), infected.argmax(), dead))
+        else:
+            # Array of shape (values1, values2, ..., days, statuses)
+            np.save(args.file, counts)
+        return
+
+    if args.validate:
+        #  python model_runsim.py --validate --replicates=200 --lockdown=0
+        results = validate_aggregate(parameters, args.duration,
+                                     max(args.replicates, 2),
+                                     workers=args.workers,
+                                     seed=0 if args.seed is None else args.seed)
+        print('%-14s %12s %10s %12s %10s %6s' % ('', 'grid mean', 'grid std',
+              'aggr. mean', 'aggr. std', 'KS'))
+        for name, result in results.items():
+            print('%-14s %12.1f %10.1f %12.1f %10.1f %6.3f'
+                  % (name, result['grid mean'], result['grid std'],
+                     result['aggregate mean'], result['aggregate std'],
+                     result['ks']))
+        return
+
+    if args.replicates > 1:
+        # Monte-Carlo ensemble of independent runs summarised per day.
+        if args.aggregate:
+            bands = run_aggregate(parameters, args.duration, args.replicates,
+                                  workers=args.workers, seed=args.seed)
+        else:
+            bands = run_ensemble(parameters, args.duration, args.replicates,
+                                 workers=args.workers, seed=args.seed)
+        if args.file is None:
+            #  python model_runsim.py --replicates=100
+            import matplotlib.pyplot as plt
+            from model_plot import plot_ensemble
+            plot_ensemble(bands, Simulation)
+            plt.show()
+        else:
+            #  python model_runsim.py --replicates=100 --file=bands.npy
+            #
+            # Array of shape (days, statuses, bands), see model_ensemble.BANDS
+            np.save(args.file, bands)
+        return
+
+    if args.regions > 1:
+        #  python model_runsim.py --regions=100 --travel=0.01 --file=counts.csv
+        #
+        # Identical regions with the cases starting in the first one. Every
+        # traveller goes to any of the other regions with equal chance. The
+        # counts for the whole country are written as CSV.
+        regions = [dict(parameters, cases=args.cases if n == 0 else 0)
+                   for n in range(args.regions)]
+        mobility = np.full((args.regions, args.regions),
+                           args.travel / (args.regions - 1))
+        with Metapopulation(regions, mobility, workers=args.workers,
+                            seed=args.seed) as country:
+            run_headless(country, args.duration, args.file)
+        return
+
     # Set up the simulation
-    simulation = Simulation(args.size, args.size,
-                            args.recovery, args.infection, args.death,
-                            args.capacity, args.lockdown, 
-                            args.infectionCap, args.deathCap)
-    simulation.population(args.population)
-    simulation.infect_randomly(args.cases)
+    if args.replay is not None:
+        #  python model_runsim.py --replay=run.history.npz
+        history = History(args.replay)
+        simulation = history.replay()
+        args.population = history.population()
+        # A replay cannot go on past the last recorded day.
+        args.duration = min(args.duration, history.last_day)
+    elif args.resume is not None:
+        #  python model_runsim.py --resume=day100.npz
+        #
+        # Everything comes from the checkpoint except for the parameters
+        # given on the command line, so that one saved run can be
+        # continued as different scenarios.
+        simulation = Simulation.load_checkpoint(args.resume,
+                                                storage_dir=args.memmap)
+        for option, name in [('recovery', 'recovery'),
+                             ('infection', 'infection'),
+                             ('death', 'death'),
+                             ('capacity', 'capacity'),
+                             ('lockdown', 'lockdown'),
+                             ('infectionCap', 'infectionCap'),
+                             ('deathCap', 'deathCap'),
+                             ('engine', 'engine'),
+                             ('movement', 'movement'),
+                             ('distance', 'movement_distance')]:
+            if option in given:
+                setattr(simulation, Simulation.PARAMETERS[name],
+                        getattr(args, option))
+        if simulation.engine == 'cell' and simulation.storage == 'memmap':
+            parser.error("--engine=cell cannot be used with a checkpoint "
+                         "resumed with memmap storage")
+        # The y axis of the plots is set from the population of the run.
+        args.population = int(simulation.counts.sum()
+                              - simulation.counts[Simulation.SPACE])
+    else:
+        simulation = Simulation(args.size, args.size,
+                                args.recovery, args.infection, args.death,
+                                args.capacity, args.lockdown, 
+                                args.infectionCap, args.deathCap,
+                                engine=args.engine, movement=args.movement,
+                                movement_distance=args.distance,
+                                storage='memory' if args.memmap is None else 'memmap',
+                                storage_dir=args.memmap, seed=args.seed)
+        simulation.population(args.population)
+        simulation.infect_randomly(args.cases)
+
+    if args.live is not None:
+        #  python model_runsim.py --headless --live=8000
+        #
+        # The server runs in its own thread and only ever gets the latest
+        # day, so it never slows the simulation down.
+        server = LiveServer(port=args.live)
+        print('Streaming to http://%s:%d/events' % (server.host, server.port),
+              file=sys.stderr)
+        # Read the counts directly: get_counts_status is itself timed by
+        # the profiler, which would add a phase to every record.
+        def counts(simulation=simulation):
+            return {status: int(simulation.counts[statusnum])
+                    for status, statusnum in Simulation.STATUSES.items()}
+        profiler = LiveProfiler(server, counts, args.profile_trace)
+        simulation.profiler = profiler
+        atexit.register(server.close)
+        atexit.register(profiler.close)
+    if args.profile:
+        #  python model_runsim.py --headless --profile
+        #
+        # The summary goes to stderr so that it never mixes with CSV output.
+        if args.live is None:
+            profiler = Profiler(args.profile_trace)
+            simulation.profiler = profiler
+            atexit.register(profiler.close)
+        atexit.register(lambda: print(profiler.summary(), file=sys.stderr))
+
+    if args.record is not None:
+        #  python model_runsim.py --record=run.history.npz
+        #
+        # Run the whole simulation first, then show it from the recording.
+        record_history(simulation, args.duration, args.record)
+        if args.checkpoint is not None:
+            simulation.save_checkpoint(args.checkpoint)
+            args.checkpoint = None
+        simulation = History(args.record).replay()
+
+    if args.raw_video:
+        #  python model_runsim.py --raw-video --file=video.mp4
+        if args.file is None:
+            parser.error('--raw-video needs --file')
+        export_video(simulation, args.duration, args.file, scale=args.scale)
+        if args.checkpoint is not None:
+            simulation.save_checkpoint(args.checkpoint)
+        return
+
+    if args.headless:
+        #  python model_runsim.py --headless --file=counts.csv
+        save_days = [int(day) for day in args.save_days.split(',') if day]
+        run_headless(simulation, args.duration, args.file,
+                     save_days, args.grid_file)
+        if args.checkpoint is not None:
+            simulation.save_checkpoint(args.checkpoint)
+        return
+
+    import matplotlib.pyplot as plt
+    from model_animation import Animation, get_ylim
+    from model_plot import plot_simulation
     
     # Obtain value args.population to be used in model_animation.py 
     get_ylim(args.population)
@@ -82,6 +370,9 @@ def main(*args):
             #
             # NOTE: this needs ffmpeg to be installed.
             animation.save(args.file)
+
+    if args.checkpoint is not None:
+        simulation.save_checkpoint(args.checkpoint)
             
 
 if __name__ == "__main__":
@@ -89,5 +380,4 @@ if __name__ == "__main__":
     # CLI entry point. The main() function can also be imported and called
     # with string arguments.
     #
-    import sys
     main(*sys.argv[1:])
\ No newline at end of file
@@ -1,7 +1,12 @@
 import numpy as np
-from numpy.random import random, randint
-import random
-from itertools import islice
+import json
+import os
+import shutil
+import tempfile
+import weakref
+import zipfile
+
+from model_profile import NULL_PROFILER
 
 
 class Simulation:
@@ -37,8 +42,60 @@ class Simulation:
         
     }
     
+    # Engines available to advance the grid by one day:
+    #   'cell'  - visit every cell in Python (original implementation)
+    #   'numpy' - update the whole grid at once with array operations
+    #   'sparse' - only update infected people and their neighbours, using
+    #              'numpy' instead while that is a large part of the grid
+    ENGINES = ('cell', 'numpy', 'sparse')
+    
+    # The sparse engine switches to the numpy engine when the infected
+    # people and their neighbours make up more than this fraction of cells.
+    SPARSE_MAX_FRACTION = 0.1
+    
+    # How people move around the grid when there is no lockdown:
+    #   'mix'   - everyone is moved to a random cell anywhere in the grid
+    #   'local' - people step to an empty cell at most movement_distance away
+    MOVEMENTS = ('mix', 'local')
+    
+    # Where the grid is stored:
+    #   'memory' - an ordinary numpy array
+    #   'memmap' - two files mapped with np.memmap in storage_dir, processed
+    #              TILE_CELLS cells (whole rows) at a time so that grids
+    #              larger than RAM can be simulated. Without a storage_dir
+    #              a temporary one is used and removed with the simulation.
+    STORAGES = ('memory', 'memmap')
+    TILE_CELLS = 2**24
+    
+    # Constructor arguments and the attributes they are stored in. These are
+    # saved in checkpoints so that the simulation can be recreated.
+    PARAMETERS = {
+        'width': 'width',
+        'height': 'height',
+        'recovery': 'recovery_probability',
+        'infection': 'infection_probability_healthcare',
+        'death': 'death_probability_healthcare',
+        'capacity': 'healthcare_capacity',
+        'lockdown': 'lockdown_when_cases',
+        'infectionCap': 'infection_probability_healthCap',
+        'deathCap': 'death_probability_healthCap',
+        'engine': 'engine',
+        'movement': 'movement',
+        'movement_distance': 'movement_distance',
+        'storage': 'storage',
+    }
+    
     def __init__(self, width, height, recovery, infection, death, 
-                 capacity, lockdown, infectionCap, deathCap,):
+                 capacity, lockdown, infectionCap, deathCap, engine='cell',
+                 movement='mix', movement_distance=1,
+                 storage='memory', storage_dir=None, seed=None):
+        # Every simulation has its own random number generator. seed can be
+        # an int or a np.random.SeedSequence (e.g. spawned for one worker).
+        self.rng = np.random.default_rng(seed)
+        
+        # Replaced by a model_profile.Profiler to time each part of update().
+        self.profiler = NULL_PROFILER
+        
         # Basic simulation parameters:
         self.day = 0
         self.infection_probability = 0
@@ -57,41 +114,150 @@ class Simulation:
         self.infection_probability_healthCap = infectionCap
         self.death_probability_healthCap = deathCap
         
-
+        if engine not in self.ENGINES:
+            raise ValueError('Unknown engine %r, expected one of %s'
+                             % (engine, ', '.join(self.ENGINES)))
+        self.engine = engine
+        
+        if movement not in self.MOVEMENTS:
+            raise ValueError('Unknown movement %r, expected one of %s'
+                             % (movement, ', '.join(self.MOVEMENTS)))
+        self.movement = movement
+        self.movement_distance = movement_distance
+        
+        if storage not in self.STORAGES:
+            raise ValueError('Unknown storage %r, expected one of %s'
+                             % (storage, ', '.join(self.STORAGES)))
+        if storage == 'memmap' and engine == 'cell':
+            raise ValueError("The 'cell' engine cannot be used with memmap storage")
+        self.storage = storage
         
-        # Initial state (just empty spaces)
-        self.state = np.zeros((width, height), int)
+        # Initial state (just empty spaces). There are only five status
+        # codes so one byte per cell is enough.
+        if storage == 'memmap':
+            # Two files: each day is computed from one into the other.
+            if storage_dir is None:
+                storage_dir = tempfile.mkdtemp(prefix='model_sir_')
+                # Our own directory: remove it with the simulation.
+                weakref.finalize(self, shutil.rmtree, storage_dir, True)
+            os.makedirs(storage_dir, exist_ok=True)
+            self.storage_dir = storage_dir
+            self.buffers = [np.memmap(os.path.join(storage_dir, 'state%d.u8' % n),
+                                      np.uint8, 'w+', shape=(width, height))
+                            for n in range(2)]
+            self.state = self.buffers[0]
+            self.tile_rows = max(1, self.TILE_CELLS // height)
+        else:
+            self.state = np.zeros((width, height), np.uint8)
+            self.tile_rows = width
         self.state[:, :] = self.SPACE
         
-    def population(self, num):
-        """Place number of people randomly in the grid of empty spaces"""
-        people = []
+        # Number of cells with each status code, kept up to date as the
+        # state changes so that it never needs to be recounted.
+        self.counts = np.zeros(len(self.STATUSES), np.int64)
+        self.counts[self.SPACE] = width * height
         
-        num_people = 0
+        # Flat indices of the infected cells, used by the sparse engine. None
+        # means unknown (e.g. after moving people) and it will be recomputed.
+        self.infected_cells = None
         
-        while num_people < num:
-            i = randint(self.width)
-            j = randint(self.height)
-            
-            if (i,j) not in people:
-                people.append((i,j))
-                num_people += 1
-                
-                self.state[i, j] = self.SUSCEPTIBLE
+        # Colour of each status code (palette[statusnum] is an RGB triple)
+        # and the buffer get_rgb_matrix fills with it.
+        self.palette = np.zeros((max(self.STATUSES.values()) + 1, 3), np.uint8)
+        for status, statusnum in self.STATUSES.items():
+            colour_name = self.COLOURMAP[status] #eg. gray
+            self.palette[statusnum] = self.COLOURMAP_RGB[colour_name]
+        self.rgb_matrix = None
+        
+    def population(self, num):
+        """Place number of people randomly in the grid of empty spaces"""
+        if num > self.counts[self.SPACE]:
+            raise ValueError('Cannot place %d people in %d empty cells'
+                             % (num, self.counts[self.SPACE]))
+        self.change_randomly(self.SPACE, self.SUSCEPTIBLE, num)
                 
     
     def infect_randomly(self,num):
         """Choose num people randomly and make them infected"""
-        # Choose a random x, y coordinate and make that person infected
-        # Without repeating
-        # Num is number of people infected
-        row = random.sample(range(self.width), num)
-        column = random.sample(range(self.height), num)
-        
-        for i in row:
-            j = random.sample(range(len(column)), 1)[0]
-            self.state[i,j] = self.INFECTED
+        # Choose num different susceptible people (never empty spaces) so
+        # that exactly num people are infected.
+        if num > self.counts[self.SUSCEPTIBLE]:
+            raise ValueError('Cannot infect %d people out of %d susceptible'
+                             % (num, self.counts[self.SUSCEPTIBLE]))
+        self.change_randomly(self.SUSCEPTIBLE, self.INFECTED, num)
+        self.infected_cells = None
+    
+    
+    def change_randomly(self, old, new, num):
+        """Change num randomly chosen cells with status old to status new
+
+        Cells are sampled without replacement from the flattened indices of
+        the cells with status old. This is done one tile of rows at a time
+        (the whole grid is a single tile unless using memmap storage): the
+        number of chosen cells in each tile is drawn first and then that
+        many cells are sampled in the tile.
+        """
+        tiles = list(self.tiles())
+        available = [np.count_nonzero(self.state[rows] == old) for rows in tiles]
+        remaining = sum(available)
+        
+        self.counts[old] -= num
+        self.counts[new] += num
+        for rows, count in zip(tiles, available):
+            if num == 0:
+                break
+            chosen = self.split_sample(num, count, remaining)
+            remaining -= count
+            num -= chosen
+            
+            tile = self.state[rows].reshape(-1)
+            cells = np.flatnonzero(tile == old)
+            tile[cells[self.sample_without_replacement(len(cells), chosen)]] = new
+    
+    
+    def split_sample(self, k, good, total):
+        """How many of k items sampled from total items are among good of them"""
+        if total - good == 0:
+            return k
+        if total < 10**9:
+            return self.rng.hypergeometric(good, total - good, k)
+        # numpy's hypergeometric is limited to 10**9 items. For more items
+        # the binomial is indistinguishable; just keep the result possible.
+        chosen = self.rng.binomial(k, good / total)
+        return min(max(chosen, k - (total - good)), good)
+    
+    
+    def tiles(self, offset=0):
+        """Slices of the rows of each tile of the grid
+
+        With an offset the first tile only has offset rows, so that the
+        tile boundaries are shifted by that much.
+        """
+        start = 0
+        stop = offset % self.tile_rows or self.tile_rows
+        while start < self.width:
+            yield slice(start, min(stop, self.width))
+            start, stop = stop, stop + self.tile_rows
                 
+
+    def sample_without_replacement(self, n, k):
+        """Array of k different random integers from range(n)"""
+        # Choosing more than half is done by choosing the ones to leave out.
+        if 2 * k > n:
+            keep = np.ones(n, bool)
+            keep[self.sample_without_replacement(n, n - k)] = False
+            return np.flatnonzero(keep)
+        
+        # Draw batches of random integers and throw away the ones that were
+        # already taken. At most half are taken so this finishes quickly.
+        taken = np.zeros(n, bool)
+        count = 0
+        while count < k:
+            draws = self.rng.integers(n, size=k - count)
+            taken[draws] = True
+            count = np.count_nonzero(taken)
+        return np.flatnonzero(taken)
+    
     
     def update(self):
         """Advance the simulation by one day"""
@@ -99,56 +265,148 @@ class Simulation:
         # someone recovers but was infected yesterday their neighbours might
         # still become infected today.
         old_state = self.state
-        new_state = old_state.copy()
+        profiler = self.profiler
         
-        for i in range(self.width):
-            for j in range(self.height):
-                new_state[i, j] = self.get_new_status(old_state, i, j)
+        # The sparse engine reports how many cells it looked at itself.
+        cells = 0 if self.engine == 'sparse' else old_state.size
+        with profiler.phase('transition', cells):
+            if self.engine == 'numpy':
+                new_state = self.get_new_state_dense(old_state)
+            elif self.engine == 'sparse':
+                new_state = self.get_new_state_sparse(old_state)
+            else:
+                new_state = old_state.copy()
+                draws = self.rng.random((2, self.width, self.height))
+                for i in range(self.width):
+                    for j in range(self.height):
+                        new_state[i, j] = self.get_new_status(old_state, i, j,
+                                                              draws[:, i, j])
+        if self.engine == 'cell':
+            # One pass over the new grid to refresh the counts.
+            self.recount(new_state)
         self.state = new_state
         
         
-        status_infected = self.get_counts_status()
-        for infected, count in islice(status_infected.items(),2,3):
+        count = self.counts[self.INFECTED]
             
-            # Implement lockdown when cases is above certain value.
-            # If user state args.lockdown = 0, means no lockdown will be implemented
-            if count < self.lockdown_when_cases or self.lockdown_when_cases == 0:
-                # Shuffle the gird to represent movement when no lockdown.
-                for n in range(self.width):
-                    np.random.shuffle(self.state[n])
-                    np.random.shuffle(self.state)
-                    
-            # Change infection and death probabilities when healthcare
-            # capacity is reached.
-            # If user state args.capacity = 0, means infinite healthcare capacity
-            if self.healthcare_capacity != 0:
-                if count > self.healthcare_capacity:
-                    if self.death_probability_healthCap: 
-                        self.death_probability = self.death_probability_healthCap
-                        self.infection_probability = self.infection_probability_healthCap 
-
-            if count < self.healthcare_capacity or self.healthcare_capacity == 0:
+        # Implement lockdown when cases is above certain value.
+        # If user state args.lockdown = 0, means no lockdown will be implemented
+        if count < self.lockdown_when_cases or self.lockdown_when_cases == 0:
+            # Move people around the grid when no lockdown.
+            with profiler.phase('movement', new_state.size):
+                self.move()
+                
+        # Change infection and death probabilities when healthcare
+        # capacity is reached.
+        # If user state args.capacity = 0, means infinite healthcare capacity
+        if self.healthcare_capacity != 0:
+            if count > self.healthcare_capacity:
                 if self.death_probability_healthCap: 
-                    self.death_probability = self.death_probability_healthcare
-                    self.infection_probability = self.infection_probability_healthcare
-                    
+                    self.death_probability = self.death_probability_healthCap
+                    self.infection_probability = self.infection_probability_healthCap 
+
+        if count < self.healthcare_capacity or self.healthcare_capacity == 0:
+            if self.death_probability_healthCap: 
+                self.death_probability = self.death_probability_healthcare
+                self.infection_probability = self.infection_probability_healthcare
+                
         self.day += 1
+        profiler.end_step(self.day)
+    
+    
+    def move(self):
+        """Move people around the grid using the chosen movement model"""
+        # Infected people will be somewhere else afterwards.
+        self.infected_cells = None
+        
+        # With memmap storage people move within a tile at a time. The tile
+        # boundaries are shifted by half a tile every other day so that
+        # people still get across them. A grid in one tile is moved whole.
+        offset = 0
+        if self.tile_rows < self.width:
+            offset = (self.day % 2) * (self.tile_rows // 2)
+        for rows in self.tiles(offset):
+            if self.storage == 'memmap':
+                tile = np.array(self.state[rows])
+            else:
+                tile = self.state[rows]
+            
+            if self.movement == 'local':
+                self.move_local(tile, self.movement_distance)
+            else:
+                self.move_mix(tile)
+            
+            if self.storage == 'memmap':
+                self.state[rows] = tile
+    
     
+    def move_mix(self, state):
+        """Move everyone to a random cell (full mixing of the grid)"""
+        # A single random permutation of all the cells. This shuffles a
+        # flattened view so the grid itself is rearranged in place.
+        self.rng.shuffle(state.reshape(-1))
     
-    def get_new_status(self, state, i, j):
+    
+    def move_local(self, state, distance):
+        """Move people to a random empty cell at most distance away
+
+        Every person picks a random cell in the (2*distance+1)**2 square
+        around them. If that cell is inside the grid and empty they move
+        there. When several people pick the same empty cell one of them,
+        chosen randomly, gets it and the others stay where they are.
+        """
+        width, height = state.shape
+        flat = state.reshape(-1)
+        # Everything here is per person, in 32 bits when the grid allows.
+        index = np.int32 if flat.size + distance * height < 2**31 else np.int64
+        people = np.flatnonzero(flat != self.SPACE).astype(index)
+        # Random order so that conflicts are won by a random person.
+        self.rng.shuffle(people)
+        
+        i, j = np.divmod(people, index(height))
+        i += self.rng.integers(-distance, distance + 1, len(people), index)
+        j += self.rng.integers(-distance, distance + 1, len(people), index)
+        inside = (i >= 0) & (i < width) & (j >= 0) & (j < height)
+        people = people[inside]
+        targets = i[inside]
+        del i
+        targets *= height
+        targets += j[inside]
+        del j, inside
+        
+        empty = flat[targets] == self.SPACE
+        people = people[empty]
+        targets = targets[empty]
+        
+        # Resolve conflicts: the first person (in the random order) to pick
+        # a cell gets it. This needs memory per person, not per cell.
+        targets, winners = np.unique(targets, return_index=True)
+        people = people[winners]
+        
+        # Targets were empty and people were not, so these swaps never
+        # overlap.
+        flat[targets] = flat[people]
+        flat[people] = self.SPACE
+    
+    
+    def get_new_status(self, state, i, j, draws=None):
+        # Two random numbers in [0, 1) for this person. The engines draw them
+        # for the whole grid in one go.
+        if draws is None:
+            draws = self.rng.random(2)
         status = state[i, j]
         
         # Update infected person
         if status == self.INFECTED:
-            if self.recovery_probability > random.random():
+            if self.recovery_probability > draws[0]:
                 return self.RECOVERED
-            elif self.death_probability > random.random():
+            elif self.death_probability > draws[1]:
                 return self.DEAD
 
         # Update susceptible person
         elif status == self.SUSCEPTIBLE:
             num = self.num_infected_around(state, i, j)
-            if num * self.infection_probability > random.random():
+            if num * self.infection_probability > draws[0]:
                 return self.INFECTED
 
         # Return the old status (e.g. DEAD/RECOVERED)
@@ -173,20 +431,273 @@ class Simulation:
         return number
 
 
+    def get_new_state_dense(self, state):
+        """New state of the whole grid after one day (numpy engine)"""
+        if self.storage == 'memmap':
+            return self.get_new_state_tiled(state)
+        return self.get_new_state_grid(state)
+
+
+    def get_new_state_tiled(self, state):
+        """New state of a memmap grid after one day, one tile at a time
+
+        Each tile is read together with the row above and below it (needed
+        to count infected neighbours) and its new state is written to the
+        other memmap buffer, which then becomes the current state.
+        """
+        if state is self.buffers[0]:
+            new_state = self.buffers[1]
+        else:
+            new_state = self.buffers[0]
+        
+        for rows in self.tiles():
+            top = 1 if rows.start > 0 else 0
+            bottom = 1 if rows.stop < self.width else 0
+            block = np.array(state[rows.start-top:rows.stop+bottom])
+            new_state[rows] = self.get_new_state_grid(block, (top, bottom))
+        
+        return new_state
+
+
+    def get_new_state_grid(self, state, halo=(0, 0)):
+        """New state of the whole grid after one day (vectorised engine)
+
+        This applies the same rules as get_new_status to every cell at once
+        using one batch of random numbers for the whole grid. The counts in
+        self.counts are updated from the number of people changing status.
+
+        The first halo[0] and last halo[1] rows of state are only used as
+        neighbours of the other rows: the result does not include them.
+        """
+        top, bottom = halo
+        num = self.num_infected_around_grid(state)
+        num = num[top:state.shape[0]-bottom]
+        state = state[top:state.shape[0]-bottom]
+        new_state = state.copy()
+        
+        infected = state == self.INFECTED
+        susceptible = state == self.SUSCEPTIBLE
+        
+        # Recovery and infection concern different cells so they can share
+        # the same random numbers. Dying needs a second, independent draw.
+        draws = self.rng.random(state.shape)
+        draws_death = self.rng.random(state.shape)
+        
+        recovered = infected & (self.recovery_probability > draws)
+        dead = infected & ~recovered & (self.death_probability > draws_death)
+        
+        newly_infected = susceptible & (num * self.infection_probability > draws)
+        
+        new_state[recovered] = self.RECOVERED
+        new_state[dead] = self.DEAD
+        new_state[newly_infected] = self.INFECTED
+        
+        num_recovered = np.count_nonzero(recovered)
+        num_dead = np.count_nonzero(dead)
+        num_infected = np.count_nonzero(newly_infected)
+        self.counts[self.SUSCEPTIBLE] -= num_infected
+        self.counts[self.INFECTED] += num_infected - num_recovered - num_dead
+        self.counts[self.RECOVERED] += num_recovered
+        self.counts[self.DEAD] += num_dead
+        return new_state
+
+
+    def find_cells(self, status):
+        """Flat indices of all cells with the given status"""
+        cells = [rows.start * self.height
+                 + np.flatnonzero(self.state[rows] == status)
+                 for rows in self.tiles()]
+        return np.concatenate(cells)
+
+
+    def get_new_state_sparse(self, state):
+        """New state of the grid after one day (sparse engine)
+
+        Only infected people and the susceptible people next to them can
+        change status, so only those cells are looked at. The cost depends on
+        the number of infected people rather than on the size of the grid.
+        When they make up more than SPARSE_MAX_FRACTION of the grid the
+        numpy engine is used instead.
+        """
+        num_infected = self.counts[self.INFECTED]
+        if 9 * num_infected > self.SPARSE_MAX_FRACTION * state.size:
+            self.infected_cells = None
+            self.profiler.add_items('transition', state.size)
+            return self.get_new_state_dense(state)
+        
+        flat = state.reshape(-1)
+        if self.infected_cells is None:
+            self.infected_cells = self.find_cells(self.INFECTED)
+        infected = self.infected_cells
+        
+        # Every infected person adds one to the count of each neighbour, so
+        # the number of times a cell appears is its number of infected
+        # neighbours. People at the edge of the grid have fewer neighbours.
+        i, j = np.divmod(infected, self.height)
+        neighbours = []
+        for di in (-1, 0, 1):
+            for dj in (-1, 0, 1):
+                if (di, dj) != (0, 0):
+                    ip, jp = i + di, j + dj
+                    inside = ((ip >= 0) & (ip < self.width)
+                              & (jp >= 0) & (jp < self.height))
+                    neighbours.append(ip[inside] * self.height + jp[inside])
+        neighbours = np.concatenate(neighbours)
+        neighbours = neighbours[flat[neighbours] == self.SUSCEPTIBLE]
+        susceptible, num = np.unique(neighbours, return_counts=True)
+        self.profiler.add_items('transition', len(infected) + len(susceptible))
+        
+        # Same rules as get_new_status/get_new_state_grid. All decisions are
+        # made from the old state before anything is changed, so the grid
+        # can be updated in place.
+        draws = self.rng.random(len(infected))
+        draws_death = self.rng.random(len(infected))
+        recovered = self.recovery_probability > draws
+        dead = ~recovered & (self.death_probability > draws_death)
+        
+        draws = self.rng.random(len(susceptible))
+        newly_infected = susceptible[num * self.infection_probability > draws]
+        
+        flat[infected[recovered]] = self.RECOVERED
+        flat[infected[dead]] = self.DEAD
+        flat[newly_infected] = self.INFECTED
+        
+        num_recovered = np.count_nonzero(recovered)
+        num_dead = np.count_nonzero(dead)
+        num_infected = len(newly_infected)
+        self.counts[self.SUSCEPTIBLE] -= num_infected
+        self.counts[self.INFECTED] += num_infected - num_recovered - num_dead
+        self.counts[self.RECOVERED] += num_recovered
+        self.counts[self.DEAD] += num_dead
+        
+        self.infected_cells = np.concatenate(
+                                [infected[~recovered & ~dead], newly_infected])
+        return state
+
+
+    def num_infected_around_grid(self, state):
+        """Number of infected people around every person in the grid"""
+        
+        # Pad with an empty border so that people at the edge of the grid
+        # simply have fewer neighbours, then add up the 8 shifted copies.
+        infected = np.pad(state == self.INFECTED, 1).astype(np.uint8)
+        width, height = state.shape
+        number = np.zeros(state.shape, np.uint8)
+        for di in range(3):
+            for dj in range(3):
+                # Don't count self as a neighbour
+                if (di, dj) != (1, 1):
+                    number += infected[di:di+width, dj:dj+height]
+        
+        return number
+
+
     def get_counts_status(self):
         """Dict giving number of people in each status"""
-
-        simgrid = self.state
         
+        # The counts are maintained by update() so no need to scan the grid.
         counts = {}
         
-        for status, statusnum in self.STATUSES.items():
-            count = np.count_nonzero(simgrid == statusnum)
-            counts[status] = count
+        with self.profiler.phase('get_counts_status'):
+            for status, statusnum in self.STATUSES.items():
+                counts[status] = int(self.counts[statusnum])
             
         return counts
 
 
+    def recount(self, state=None):
+        """Recount the number of people in each status from the grid
+
+        Only needed if the state is changed other than through the methods
+        of this class (e.g. by assigning to self.state directly).
+        """
+        if state is None:
+            state = self.state
+            self.infected_cells = None
+        with self.profiler.phase('recount', state.size):
+            self.counts = np.zeros(len(self.STATUSES), np.int64)
+            for rows in self.tiles():
+                self.counts += np.bincount(state[rows].ravel(),
+                                           minlength=len(self.STATUSES))
+
+
+    def save_checkpoint(self, filename):
+        """Save everything needed to resume the simulation to a file
+
+        The checkpoint is a compressed numpy .npz file holding the grid, the
+        day, the current probabilities, the parameters and the state of the
+        random number generator. Continuing a simulation loaded with
+        load_checkpoint gives exactly the same results as continuing this one.
+        """
+        parameters = {'param_' + name: getattr(self, attribute)
+                      for name, attribute in self.PARAMETERS.items()}
+        # The sparse engine draws the random numbers for the infected cells
+        # in the order of this list, which is not always sorted.
+        if self.infected_cells is not None:
+            parameters['infected_cells'] = self.infected_cells
+        np.savez_compressed(filename,
+            state=self.state,
+            counts=self.counts,
+            day=self.day,
+            infection_probability=self.infection_probability,
+            death_probability=self.death_probability,
+            rng_state=json.dumps(self.rng.bit_generator.state),
+            **parameters)
+
+
+    @classmethod
+    def load_checkpoint(cls, filename, storage_dir=None):
+        """Create a simulation from a file written by save_checkpoint
+
+        Example
+        =======
+
+        >>> sim.save_checkpoint('day100.npz')
+        >>> branch = Simulation.load_checkpoint('day100.npz')
+        >>> branch.lockdown_when_cases = 100  # try another scenario
+        >>> branch.update()
+
+        """
+        with np.load(filename) as data:
+            parameters = {name: data['param_' + name].item()
+                          for name in cls.PARAMETERS}
+            simulation = cls(**parameters, storage_dir=storage_dir)
+            simulation.read_state(filename)
+            if 'infected_cells' in data.files:
+                simulation.infected_cells = data['infected_cells']
+            simulation.counts = data['counts'].astype(np.int64)
+            simulation.day = data['day'].item()
+            simulation.infection_probability = data['infection_probability'].item()
+            simulation.death_probability = data['death_probability'].item()
+            
+            simulation.rng.bit_generator.state = json.loads(data['rng_state'].item())
+        
+        return simulation
+
+
+    def read_state(self, filename):
+        """Copy the grid saved in a checkpoint into self.state tile by tile
+
+        The grid is read straight from the compressed file so that only one
+        tile is in memory at a time (like the rest of memmap storage).
+        """
+        with zipfile.ZipFile(filename) as archive, \
+                archive.open('state.npy') as member:
+            version = np.lib.format.read_magic(member)
+            if version == (1, 0):
+                header = np.lib.format.read_array_header_1_0(member)
+            else:
+                header = np.lib.format.read_array_header_2_0(member)
+            shape, fortran_order, dtype = header
+            if shape != self.state.shape or fortran_order:
+                raise ValueError('%s does not hold a %d x %d grid'
+                                 % (filename, self.width, self.height))
+            for rows in self.tiles():
+                size = (rows.stop - rows.start) * self.height
+                tile = np.frombuffer(member.read(size * dtype.itemsize), dtype)
+                self.state[rows] = tile.reshape(-1, self.height)
+
+
     def get_rgb_matrix(self):
         """RGB matrix representing the statuses of the people in the grid
 
@@ -194,11 +705,11 @@ class Simulation:
         coloursceheme set in the class variables COLOURMAP and COLOURMAP_RGB.
         The resulting matrix is suitable to be used with e.g. matplotlib's
         imshow function.
+
+        The same uint8 buffer is reused (and overwritten) on every call.
         """
-        rgb_matrix = np.zeros((self.width, self.height, 3), int)
-        for status, statusnum in self.STATUSES.items():
-            colour_name = self.COLOURMAP[status] #eg. gray
-            colour_rgb = self.COLOURMAP_RGB[colour_name] #eg. (211,211,211)
-            rgb_matrix[self.state == statusnum] = colour_rgb
-            
-        return rgb_matrix
\ No newline at end of file
+        if self.rgb_matrix is None:
+            self.rgb_matrix = np.empty((self.width, self.height, 3), np.uint8)
+        # Look up the colour of every cell in the palette in one go.
+        np.take(self.palette, self.state, axis=0, out=self.rgb_matrix)
+        return self.rgb_matrix
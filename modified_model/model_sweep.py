@@ -0,0 +1,134 @@
+import numpy as np
+from multiprocessing import Pool
+import hashlib
+import json
+import os
+
+from model_sir import Simulation
+from model_ensemble import run_replicate
+
+
+# Parameters of model_runsim that can be swept and their types.
+SWEEP_PARAMETERS = {
+    'recovery': float,
+    'infection': float,
+    'death': float,
+    'capacity': int,
+    'lockdown': int,
+    'infectionCap': float,
+    'deathCap': float,
+}
+
+# Part of every cache key so that results computed with a different version
+# of the simulation code, or of numpy (whose random streams may change),
+# are never reused.
+_code = hashlib.sha256(np.__version__.encode())
+for _name in ('model_sir.py', 'model_ensemble.py'):
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           _name), 'rb') as _source:
+        _code.update(_source.read())
+CODE_VERSION = _code.hexdigest()
+
+
+def parse_range(text, kind=float):
+    """Values of a parameter given as 'v1,v2,...' or 'start:stop:step'
+
+    >>> parse_range('0,300,600', int)
+    [0, 300, 600]
+    >>> parse_range('0.01:0.05:0.01')
+    [0.01, 0.02, 0.03, 0.04]
+
+    The stop is never included. Values are rounded to 12 decimals so that
+    they do not carry floating point noise like 0.30000000000000004.
+    """
+    if ':' in text:
+        start, stop, step = (kind(value) for value in text.split(':'))
+        # Up to but not including stop, allowing for rounding errors when
+        # stop is a whole number of steps away.
+        number = max(0, int(np.ceil((stop - start) / step - 1e-9)))
+        return [kind(round(start + k * step, 12)) for k in range(number)]
+    return [kind(value) for value in text.split(',')]
+
+
+def cache_key(parameters, duration, seed):
+    """Hash identifying the result of one run"""
+    key = {
+        'parameters': parameters,
+        'duration': duration,
+        'seed': seed,
+        'code': CODE_VERSION,
+    }
+    text = json.dumps(key, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def run_point(job):
+    """Run one point of a sweep (called in the worker processes)"""
+    index, seed, parameters, duration = job
+    return index, run_replicate((seed, parameters, duration))
+
+
+def run_sweep(parameters, ranges, duration, seed=0, workers=None,
+              cache_dir='sweep_cache'):
+    """Run a simulation for every combination of parameter values
+
+    parameters is a dict like the one used by run_ensemble. ranges maps some
+    of its keys to lists of values and every combination of them is run
+    with the same seed. Each run's daily counts are stored in cache_dir
+    under a hash of its parameters, duration, seed and the simulation code,
+    so only runs that are not already in the cache are computed.
+
+    Returns an array of shape (len(values1), len(values2), ..., duration+1,
+    len(Simulation.STATUSES)), in the order of the keys in ranges.
+
+    Example
+    =======
+
+    >>> ranges = {'lockdown': [0, 300, 600], 'capacity': [0, 2000]}
+    >>> counts = run_sweep(parameters, ranges, 365, workers=4)
+    >>> counts.shape
+    (3, 2, 366, 5)
+
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    os.makedirs(cache_dir, exist_ok=True)
+
+    names = list(ranges)
+    shape = tuple(len(ranges[name]) for name in names)
+    counts = np.zeros(shape + (duration+1, len(Simulation.STATUSES)), int)
+
+    def filename(point):
+        return os.path.join(cache_dir, cache_key(point, duration, seed) + '.npy')
+
+    # Load what is in the cache and collect the runs that are missing.
+    missing = []
+    for index in np.ndindex(*shape):
+        point = dict(parameters)
+        for name, n in zip(names, index):
+            point[name] = ranges[name][n]
+        if os.path.exists(filename(point)):
+            counts[index] = np.load(filename(point))
+        else:
+            missing.append((index, seed, point, duration))
+
+    missing_points = {index: point for index, _, point, _ in missing}
+
+    def store(index, result):
+        # Write to a temporary file first so that an interrupted sweep never
+        # leaves a partial result in the cache.
+        point = missing_points[index]
+        temporary = filename(point) + '.tmp.npy'
+        np.save(temporary, result)
+        os.replace(temporary, filename(point))
+        counts[index] = result
+
+    if workers == 1 or len(missing) <= 1:
+        for index, result in map(run_point, missing):
+            store(index, result)
+    else:
+        with Pool(workers) as pool:
+            for index, result in pool.imap_unordered(run_point, missing):
+                store(index, result)
+
+    return counts
@@ -0,0 +1,116 @@
+import queue
+import shutil
+import subprocess
+import threading
+
+import numpy as np
+
+
+def frame_with_overlay(simulation, rgb_matrix, scale=1, bar_height=0):
+    """Frame for one day: the grid scaled up and an optional counts bar
+
+    The grid is enlarged by repeating every cell scale times in both
+    directions. If bar_height > 0 a bar of that many rows is added below it
+    showing the share of the people in each status (not counting space) in
+    the colours of the grid.
+    """
+    if scale > 1:
+        rgb_matrix = np.repeat(np.repeat(rgb_matrix, scale, axis=0), scale, axis=1)
+    if bar_height <= 0:
+        return rgb_matrix
+
+    width = rgb_matrix.shape[1]
+    bar = np.empty((bar_height, width, 3), np.uint8)
+    bar[:] = simulation.palette[simulation.SPACE]
+    statusnums = [statusnum for statusnum in simulation.STATUSES.values()
+                  if statusnum != simulation.SPACE]
+    total = sum(simulation.counts[statusnum] for statusnum in statusnums)
+    if total:
+        # Round the edges between the statuses rather than their widths so
+        # that the bar is always full.
+        edges = np.cumsum([0] + [simulation.counts[s] for s in statusnums])
+        edges = width * edges // total
+        for statusnum, left, right in zip(statusnums, edges, edges[1:]):
+            bar[:, left:right] = simulation.palette[statusnum]
+    return np.concatenate([rgb_matrix, bar])
+
+
+def export_video(simulation, duration, filename, scale=1, bar_height=8,
+                 fps=10, queue_size=8):
+    """Save the grid of every day up to duration as a video, using ffmpeg
+
+    The RGB matrix of each day (see Simulation.get_rgb_matrix) is piped to
+    ffmpeg as a raw frame without going through matplotlib. The frames are
+    written to ffmpeg by a separate thread so that the simulation keeps
+    running while ffmpeg encodes. At most queue_size frames wait in between.
+
+    Every cell is scale x scale pixels and a bar_height pixels high bar of
+    the counts of each status is drawn under the grid (bar_height=0 for no
+    bar). The video format follows the extension of filename (e.g. .mp4).
+
+    NOTE: needs ffmpeg installed and on PATH
+
+    Example
+    =======
+
+    >>> sim = Simulation(2000, 2000, 0.02, 0.03, 0.002, 0, 0, 0.05, 0.005)
+    >>> sim.population(2400000)
+    >>> sim.infect_randomly(10)
+    >>> export_video(sim, 365, 'epidemic.mp4')
+
+    """
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise RuntimeError('ffmpeg is needed to save a video but is not on PATH')
+
+    frame = frame_with_overlay(simulation, simulation.get_rgb_matrix(),
+                               scale, bar_height)
+    rows, columns = frame.shape[:2]
+    command = [ffmpeg, '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+               '-s', '%dx%d' % (columns, rows), '-r', str(fps), '-i', '-']
+    if not filename.endswith('.gif'):
+        # yuv420p (playable almost everywhere) needs an even width and height.
+        command += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+                    '-vcodec', 'libx264', '-pix_fmt', 'yuv420p']
+    command.append(filename)
+    encoder = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    frames = queue.Queue(queue_size)
+    errors = []
+
+    def write_frames():
+        while True:
+            frame = frames.get()
+            if frame is None:
+                break
+            if errors:
+                # Keep emptying the queue so the simulation never blocks.
+                continue
+            try:
+                encoder.stdin.write(frame)
+            except OSError as error:
+                errors.append(error)
+
+    writer = threading.Thread(target=write_frames, daemon=True)
+    writer.start()
+    try:
+        # get_rgb_matrix reuses its buffer so every frame is copied into
+        # bytes before the next day is computed.
+        frames.put(frame.tobytes())
+        while simulation.day < duration:
+            simulation.update()
+            frame = frame_with_overlay(simulation, simulation.get_rgb_matrix(),
+                                       scale, bar_height)
+            frames.put(frame.tobytes())
+    finally:
+        frames.put(None)
+        writer.join()
+        try:
+            encoder.stdin.close()
+        except OSError:
+            pass
+        status = encoder.wait()
+
+    if errors or status != 0:
+        raise RuntimeError('ffmpeg failed to write %s' % filename)
@@ -5,9 +5,16 @@ import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.patches import Circle
 from matplotlib import animation
-from itertools import combinations
-import random
-import time 
+import atexit
+import json
+import os
+import sys
+
+# The profiler is shared with the grid model in modified_model.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'modified_model'))
+from model_profile import NULL_PROFILER, Profiler
+from model_live import LiveServer, LiveProfiler
 
 def main(*args):
     """command line interface. There are inital values for the varibles that 
@@ -17,6 +24,11 @@ def main(*args):
     $ python simulation.py                              ~Starts the simulation
     $ python simulation.py --population=200             ~Change to population size
     $ python simulation.py --file=example.mp4           ~ saves animation to file
+    $ python simulation.py --file=example.mp4 --frames=2000 --workers=8  ~ longer video drawn on 8 cores
+    $ python simulation.py --steps-per-day=10           ~ more movement in each day
+    $ python simulation.py --checkpoint=run.npz         ~ save the run when the window is closed
+    $ python simulation.py --file=run.mp4 --live=8000   ~ watch http://127.0.0.1:8000/events
+    $ python simulation.py --resume=run.npz             ~ continue a saved run
     """
     
     
@@ -33,28 +45,222 @@ def main(*args):
                                   group 3 = age 30 - 39
                                   group 4 = age 40 - 49
                                   group 5 = age 50 - 100 """)
+    parser.add_argument('--steps-per-day', metavar='N', type=int, default=5,
+                        help='Steps (frames) of movement in each simulated day')
+    parser.add_argument('--seed', metavar='N', type=int, default=None,
+                        help='Seed for the random numbers, for reproducible runs')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time each phase of the simulation step and print a summary at exit')
+    parser.add_argument('--profile-trace', metavar='FILE', type=str, default=None,
+                        help='With --profile, also write the phase times of every step as JSON lines')
+    parser.add_argument('--live', metavar='PORT', type=int, default=None,
+                        help='Stream the counts and step times on http://127.0.0.1:PORT/events')
+    parser.add_argument('--checkpoint', metavar='FILE', type=str, default=None,
+                        help='Save the simulation to FILE when the animation is closed')
+    parser.add_argument('--resume', metavar='FILE', type=str, default=None,
+                        help='Continue a simulation saved with --checkpoint')
+    parser.add_argument('--file', metavar='FILE', type=str, default=None,
+                        help='Save the animation to FILE (e.g. .mp4 or .gif) instead of showing it')
+    parser.add_argument('--frames', metavar='N', type=int, default=100,
+                        help='Number of frames (steps) to save with --file')
+    parser.add_argument('--workers', metavar='N', type=int, default=None,
+                        help='Processes drawing frames with --file (default: all cores)')
+    parser.add_argument('--fps', metavar='N', type=int, default=10,
+                        help='Frames per second of the video saved with --file')
     args = parser.parse_args(args)
     
     """Start simulation"""
-    simulation = Simulation(args.population, args.radii,args.cases,
-                            args.age_group,styles)
-
-    simulation.do_animation()
+    if args.resume is not None:
+        simulation = Simulation.load_checkpoint(args.resume, styles)
+    else:
+        simulation = Simulation(args.population, args.radii,args.cases,
+                                args.age_group,styles,seed=args.seed,
+                                steps_per_day=args.steps_per_day)
+
+    if args.live is not None:
+        server = LiveServer(port=args.live)
+        print('Streaming to http://%s:%d/events' % (server.host, server.port),
+              file=sys.stderr)
+        profiler = LiveProfiler(server, simulation.count_states,
+                                args.profile_trace)
+        simulation.profiler = profiler
+        atexit.register(server.close)
+        atexit.register(profiler.close)
+    if args.profile:
+        if args.live is None:
+            profiler = Profiler(args.profile_trace)
+            simulation.profiler = profiler
+            atexit.register(profiler.close)
+        atexit.register(lambda: print(profiler.summary(), file=sys.stderr))
+
+    if args.file is not None:
+        from simulation_video import export_video
+        export_video(simulation, args.file, args.frames, args.workers, args.fps)
+    else:
+        simulation.do_animation()
+
+    if args.checkpoint is not None:
+        simulation.save_checkpoint(args.checkpoint)
     
 
+# Cells of the broad phase checked for each cell: itself and the neighbours
+# after it, so that every pair of neighbouring cells is checked once.
+NEIGHBOUR_CELLS = [(0, 0), (1, -1), (1, 0), (1, 1), (0, 1)]
+
+
+def overlapping_pairs(positions, radii):
+    """Indices (i, j) with i < j of the overlapping circles, sorted
+
+    The box [0, 2] x [0, 2] is divided into square cells at least as wide
+    as the largest circle so that circles can only overlap if they are in
+    the same or neighbouring cells. Only those pairs are tested, all at
+    once, so the cost grows with the number of circles rather than the
+    number of pairs. The pairs come in the same order as from
+    itertools.combinations(range(n), 2).
+    """
+    n = len(positions)
+    if n < 2:
+        return np.zeros(0, int), np.zeros(0, int)
+
+    # Never more cells than circles, so that the cells cost nothing extra.
+    cells = max(1, min(int(2 / (2 * radii.max())), int(np.sqrt(n))))
+    width = 2 / cells
+    cell = np.clip((positions // width).astype(np.int64), 0, cells - 1)
+    keys = cell[:, 0] * cells + cell[:, 1]
+    order = np.argsort(keys, kind='stable')
+    cell = cell[order]
+    first = np.searchsorted(keys[order], np.arange(cells * cells), 'left')
+    last = np.searchsorted(keys[order], np.arange(cells * cells), 'right')
+
+    candidates_i, candidates_j = [], []
+    for dx, dy in NEIGHBOUR_CELLS:
+        x, y = cell[:, 0] + dx, cell[:, 1] + dy
+        inside = (x < cells) & (y >= 0) & (y < cells)
+        key = np.where(inside, x * cells + y, 0)
+        start = np.where(inside, first[key], 0)
+        stop = np.where(inside, last[key], 0)
+        if (dx, dy) == (0, 0):
+            # Only the circles after this one in its own cell.
+            start = np.arange(n) + 1
+        count = np.maximum(stop - start, 0)
+        i = np.repeat(np.arange(n), count)
+        j = np.repeat(start - np.cumsum(count) + count, count) + np.arange(count.sum())
+        candidates_i.append(i)
+        candidates_j.append(j)
+    i = order[np.concatenate(candidates_i)]
+    j = order[np.concatenate(candidates_j)]
+
+    # Narrow phase on all the candidates at once.
+    distance = np.hypot(*(positions[i] - positions[j]).T)
+    close = distance < radii[i] + radii[j]
+    i, j = np.minimum(i[close], j[close]), np.maximum(i[close], j[close])
+    pairs = np.lexsort((j, i))
+    return i[pairs], j[pairs]
+
+
+class ParticleStore:
+    """Positions, velocities and radii of all the particles in arrays
+
+    positions and velocities have shape (n, 2) and radii shape (n,), so
+    all the particles can be moved with a few whole-array operations. A
+    Particle added to the store becomes a view of its row.
+    """
+
+    def __init__(self, n):
+        self.positions = np.zeros((n, 2))
+        self.velocities = np.zeros((n, 2))
+        self.radii = np.zeros(n)
+        self.size = 0
+
+    def add(self, particle):
+        """Store particle in the next row and make it a view of that row"""
+        index = self.size
+        self.positions[index] = particle.r
+        self.velocities[index] = particle.v
+        self.radii[index] = particle.radius
+        particle._r = self.positions[index]
+        particle._v = self.velocities[index]
+        self.size += 1
+
+    def advance(self, dt):
+        """Move every particle by dt, bouncing off the walls of the box
+
+        The same as Particle.advance for every particle.
+        """
+        r, v = self.positions, self.velocities
+        radius = self.radii[:, None]
+        r += v * dt
+
+        low = r - radius < 0
+        np.copyto(r, np.broadcast_to(radius, r.shape), where=low)
+        np.negative(v, out=v, where=low)
+
+        high = r + radius > 2
+        np.copyto(r, 2 - radius, where=high)
+        np.negative(v, out=v, where=high)
+
+    def collide(self, i, j):
+        """Elastic collisions of the particles i[k] and j[k] for every k
+
+        The masses are proportional to the radius squared. Collisions are
+        resolved in rounds: each round takes the pairs whose particles are
+        in no earlier pair that is left, so that they are all resolved at
+        once exactly like one collision each. A particle in several
+        collisions goes through them in the order of the pairs, so the
+        result is always the same and energy and momentum are conserved.
+        Pairs that are already moving apart (e.g. still overlapping after
+        colliding in the last step) are left alone.
+        """
+        while len(i):
+            pair = np.arange(len(i))
+            first = np.full(len(self.radii), len(i))
+            np.minimum.at(first, i, pair)
+            np.minimum.at(first, j, pair)
+            now = (first[i] == pair) & (first[j] == pair)
+            self.collide_separate(i[now], j[now])
+            i, j = i[~now], j[~now]
+
+    def collide_separate(self, i, j):
+        """Elastic collisions of pairs of particles that all differ"""
+        r, v = self.positions, self.velocities
+        dr = r[i] - r[j]
+        approach = np.einsum('ij,ij->i', v[i] - v[j], dr)
+        moving_closer = approach < 0
+        i, j = i[moving_closer], j[moving_closer]
+        dr, approach = dr[moving_closer], approach[moving_closer]
+
+        m = self.radii**2
+        distance2 = np.einsum('ij,ij->i', dr, dr)
+        impulse = (2 * approach / ((m[i] + m[j]) * distance2))[:, None] * dr
+        v[i] -= m[j][:, None] * impulse
+        v[j] += m[i][:, None] * impulse
+
+
 class Particle:
     """Class for that produces the particles and their movements"""
 
     def __init__(self, x, y, vx, vy, radius, styles=None):
         """Initialize the particle's position, velocity, and radius."""
 
-        self.r = np.array((x, y))
-        self.v = np.array((vx, vy))
+        # Own arrays until the particle is added to a ParticleStore.
+        self._r = np.array((x, y), float)
+        self._v = np.array((vx, vy), float)
         self.radius = radius
 
         self.styles = styles
 
-
+    @property
+    def r(self):
+        return self._r
+    @r.setter
+    def r(self, position):
+        self._r[:] = position
+    @property
+    def v(self):
+        return self._v
+    @v.setter
+    def v(self, velocity):
+        self._v[:] = velocity
 
     @property
     def x(self):
@@ -128,10 +334,38 @@ class Simulation:
         'vaccinated':'purple',
     }
 
-    def __init__(self, n, radius,cases,age_group,styles=None):
+    # Edge styles of the particles in each state other than non-infected
+    # and the codes used for the states in the states array and checkpoints.
+    STYLES = {
+        'infected': {'edgecolor': 'C3', 'linewidth': 2, 'fill': 1},
+        'recovered': {'edgecolor': 'C2', 'linewidth': 2, 'fill': 1},
+        'dead': {'edgecolor': '0', 'linewidth': 2, 'fill': 1},
+        'vaccinated': {'edgecolor': 'C4', 'linewidth': 2, 'fill': 1},
+    }
+    NON_INFECTED, INFECTED, RECOVERED, DEAD, VACCINATED = range(5)
+    STATE_CODES = {
+        'non-infected': NON_INFECTED,
+        'infected': INFECTED,
+        'recovered': RECOVERED,
+        'dead': DEAD,
+        'vaccinated': VACCINATED,
+    }
+
+    def __init__(self, n, radius,cases,age_group,styles=None,seed=None,
+                 steps_per_day=5):
         """Initialize simulation for n people with the inital number of infected as the variable cases
+
+        Every step is 1/steps_per_day of a day on the simulation clock, so
+        the illness lasts the same number of steps however fast they run.
         """
+        # All random numbers come from this simulation's own generator. seed
+        # can be an int or a np.random.SeedSequence (e.g. for one worker).
+        self.rng = np.random.default_rng(seed)
+        # Replaced by a model_profile.Profiler to time each part of a step.
+        self.profiler = NULL_PROFILER
         self.day = 0
+        self.steps = 0
+        self.steps_per_day = steps_per_day
         self.cases = cases
         self.age_group = age_group
         self.init_people(n, radius, styles)
@@ -146,88 +380,97 @@ class Simulation:
             iterator = iter(radius)
             assert n == len(radius)
         except TypeError:
-            def r_gen(n, radius):
-                for i in range(n):
-                    yield radius
-            radius = r_gen(n, radius)
+            radius = [radius] * n
+
+        # People already placed in each cell of a grid at least as wide as
+        # a person, so a new person is only checked against nearby people.
+        width = max(2 * max(radius, default=0), 1e-9)
+        placed = {}
 
         self.infected = 0 
         self.n = n
         self.particles = []
-        self.particles_age={}
-        self.infected_particles = []
-        self.recovered_particles = []
-        self.dead_particles = []
-        self.vaccinated_particles = []
+        self.store = ParticleStore(n)
+        # The state of every particle (see STATE_CODES), the day on the
+        # clock it was infected (nan if never) and its age (-1 until
+        # age_setter runs).
+        self.states = np.full(n, self.NON_INFECTED, np.uint8)
+        self.time_infected = np.full(n, np.nan)
+        self.ages = np.full(n, -1)
+        # Everyone has the same speed in a random direction.
+        vphi = 2*np.pi * self.rng.random(n)
         for i, rad in enumerate(radius):
 
             while True:
 
-                x, y = np.random.uniform(0.0, 2.0, 2)
+                x, y = self.rng.uniform(0.0, 2.0, 2)
 
                 vr = 1
-                vphi = 2*np.pi * np.random.random()
-                vx, vy = vr * np.cos(vphi), vr * np.sin(vphi)
-                infected_style = {'edgecolor': 'C3', 'linewidth': 2, 'fill': 1}
-                if self.infected < self.cases:
-                    particle = Particle(x, y, vx, vy, rad, infected_style)
-                    self.infected_particles.append(particle)
-                    particle.time_infected = time.time()
-                    self.infected += 1
-                else:
-                    particle = Particle(x, y, vx, vy, rad, styles)
+                vx, vy = vr * np.cos(vphi[i]), vr * np.sin(vphi[i])
+                particle = Particle(x, y, vx, vy, rad, styles)
 
-                for p2 in self.particles:
+                cx, cy = int(x // width), int(y // width)
+                nearby = (p2 for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                          for p2 in placed.get((cx + dx, cy + dy), ()))
+                for p2 in nearby:
                     if p2.overlaps(particle):
                         break
                 else:
                     self.particles.append(particle)
+                    self.store.add(particle)
+                    placed.setdefault((cx, cy), []).append(particle)
                     break
 
+            # The first cases people placed are infected.
+            if self.infected < self.cases:
+                self.change_state([i], 'infected')
+                self.infected += 1
+
+    @property
+    def clock(self):
+        """Time in days on the simulation clock"""
+        return self.steps / self.steps_per_day
+
+    def tick(self):
+        """Move the simulation clock on by one step"""
+        self.steps += 1
+        self.day = self.steps // self.steps_per_day
+
+    def change_state(self, indices, status):
+        """Move the particles at indices to status (a key of STATE_CODES)
+
+        Sets their code in the states array, the style they are drawn with
+        and, when they are infected, the time they were infected.
+        """
+        indices = np.asarray(indices, np.intp)
+        self.states[indices] = self.STATE_CODES[status]
+        if status == 'infected':
+            self.time_infected[indices] = self.clock
+        style = self.STYLES.get(status)
+        for index in indices.tolist():
+            self.particles[index].styles = style
+
     def people_interactions(self):
         """Detect and handle any collisions between People.
         When two People collide, they change their velcoities
         """
 
-        def change_velocities(p1, p2):
-            """
-            Particles p1 and p2 have collided elastically: update their
-            velocities.
-            """
-
-            m1, m2 = p1.radius**2, p2.radius**2
-            M = m1 + m2
-            r1, r2 = p1.r, p2.r
-            d = np.linalg.norm(r1 - r2)**2
-            v1, v2 = p1.v, p2.v
-            u1 = v1 - 2*m2 / M * np.dot(v1-v2, r1-r2) / d * (r1 - r2)
-            u2 = v2 - 2*m1 / M * np.dot(v2-v1, r2-r1) / d * (r2 - r1)
-            p1.v = u1
-            p2.v = u2
-
-
-        pairs = combinations(range(self.n), 2)
-        for i,j in pairs:
-            if self.particles[i].overlaps(self.particles[j]):
-                change_velocities(self.particles[i], self.particles[j])
-                if self.particles[i] in self.vaccinated_particles or  self .particles[j] in self.vaccinated_particles:
-                    
-                    continue 
-                
-                elif self.particles[i] in self.infected_particles and not self.particles[j] in self.recovered_particles and not self.particles[j] in self.dead_particles:
-                    
-                    self.particles[j].time_infected = time.time()
-                    self.infected_particles.append(self.particles[j])
-                    self.particles[j].styles = {'edgecolor': 'C3', 'linewidth': 2, 'fill': 1}
+        # Only the pairs that overlap, found with a grid of cells.
+        store = self.store
+        first, second = overlapping_pairs(store.positions, store.radii)
+        self.profiler.add_items('people_interactions', len(first))
+        store.collide(first, second)
+
+        # Infections pass between everyone in contact: an infected person
+        # infects a non-infected one (not the vaccinated, recovered or dead).
+        states = self.states
+        caught = np.concatenate([
+            second[(states[first] == self.INFECTED)
+                   & (states[second] == self.NON_INFECTED)],
+            first[(states[second] == self.INFECTED)
+                  & (states[first] == self.NON_INFECTED)]])
+        self.change_state(np.unique(caught), 'infected')
 
-                elif self.particles[j] in self.infected_particles and not self.particles[i] in self.recovered_particles and not self.particles[i] in self.dead_particles:
-                    
-                    self.particles[i].time_infected = time.time() 
-                    self.infected_particles.append(self.particles[i])
-                    self.particles[i].styles = {'edgecolor': 'C3', 'linewidth': 2, 'fill': 1}
-   
-    
-   
     def  duration_of_illness(self, age_group):
         """takes the age of the particles and sets the duration inwhich they are infected"""        
         
@@ -251,116 +494,164 @@ class Simulation:
     def age_setter(self):
         """Function that sets the age each indiviual particle"""
         
-        for i in self.particles:
-            Random=random.randint(0,100)
-            if Random<19:
-                self.particles_age[i]=random.randint(0,16)
-                
-            elif 19<=Random<82:
-                self.particles_age[i]=random.randint(16,65)
-                
-            elif 82<Random:
-                self.particles_age[i]=random.randint(65,100)
+        # Draw the age band and an age in every band for everyone at once,
+        # then pick the age from the right band.
+        n = len(self.particles)
+        Random = self.rng.integers(0, 101, n)
+        ages = np.select([Random < 19, Random < 82],
+                         [self.rng.integers(0, 17, n),
+                          self.rng.integers(16, 66, n)],
+                         self.rng.integers(65, 101, n))
+        self.ages = ages
     
     
     def recovery_death(self):
         """Function that kills or recovers an infected particle"""
         
-        for i in self.infected_particles:
-            if time.time() - i.time_infected > Simulation.duration_of_illness('',1):
-           
-                chance = random.randint(1,10)
-                
-                if chance == 1:
-                    i.styles = {'edgecolor': '0', 'linewidth': 2, 'fill': 1}
-                    
-                    self.infected_particles.remove(i)
-                    self.dead_particles.append(i)
-                else:
-                    i.styles = {'edgecolor': 'C2', 'linewidth': 2, 'fill': 1}
-                   
-                    self.infected_particles.remove(i)
-                    self.recovered_particles.append(i)
-                        
-    
+        infected = np.flatnonzero(self.states == self.INFECTED)
+        self.profiler.add_items('recovery_death', len(infected))
+        chances = self.rng.integers(1, 11, len(infected))
+        # duration_of_illness is in days.
+        over = (self.clock - self.time_infected[infected]
+                > Simulation.duration_of_illness('',1))
+        self.change_state(infected[over & (chances == 1)], 'dead')
+        self.change_state(infected[over & (chances != 1)], 'recovered')
+
     def vaccine(self,vaccination_rate):
         """Vaccinates people that are non-infected such that they are unable to be infected""" 
         
         chance_above_50=85
         chance_below_50=100-chance_above_50
-        for i in self.particles:
-            if self.day > 50: 
-                
-                if ((i not in self.infected_particles)
-                    and (i not in self.dead_particles)
-                    and (i not in self.vaccinated_particles)
-                    and (i not in self.recovered_particles)):
-
-                    chance= random.randint(0,100)
-                    
-                    if chance<=vaccination_rate:
-
-                        if self.particles_age[i]>=50:
-                            
-                            if random.randint(0,100) <= chance_above_50:
-                               
-                                i.styles = {'edgecolor': 'C4', 'linewidth': 2, 'fill': 1}
-                                self.vaccinated_particles.append(i)
-
-                               
-                        elif 10<= self.particles_age[i]<50:
-                            
-                            if random.randint(0,100)<=chance_below_50:
-                                
-                                i.styles = {'edgecolor': 'C4', 'linewidth': 2, 'fill': 1}
-                                self.vaccinated_particles.append(i)
-        return self.vaccinated_particles
-                
-                  
+        # Both random numbers for everyone, drawn in one go.
+        chances = self.rng.integers(0, 101, len(self.particles))
+        accepts = self.rng.integers(0, 101, len(self.particles))
+        if self.day > 50:
+            # People under 10 are not vaccinated.
+            ages = self.ages
+            accepted = np.where(ages >= 50, accepts <= chance_above_50,
+                                (ages >= 10) & (accepts <= chance_below_50))
+            vaccinated = ((self.states == self.NON_INFECTED)
+                          & (chances <= vaccination_rate) & accepted)
+            self.change_state(np.flatnonzero(vaccinated), 'vaccinated')
 
     def advance_animation(self, dt):
         """Advance the animation by dt, returning the updated Circles list."""
 
+        self.step(dt)
         for i, p in enumerate(self.particles):
-            p.advance(dt)
             self.circles[i].center = p.r
+        return self.circles
+
+    def step(self, dt):
+        """Advance the whole simulation (movement, infection, recovery,
+        vaccination) by dt without drawing anything."""
+
+        profiler = self.profiler
+        n = len(self.particles)
+        with profiler.phase('advance', n):
+            self.store.advance(dt)
             
-        self.people_interactions()
-        self.recovery_death()
-        self.age_setter()
+        # people_interactions reports the number of pairs in contact.
+        with profiler.phase('people_interactions'):
+            self.people_interactions()
+        # recovery_death reports the number of infected people itself.
+        with profiler.phase('recovery_death'):
+            self.recovery_death()
+        with profiler.phase('age_setter', n):
+            self.age_setter()
         self.duration_of_illness(self.age_group)
-        self.vaccine(self.vaccination_rate)
-        return self.circles
+        with profiler.phase('vaccine', n):
+            self.vaccine(self.vaccination_rate)
+        profiler.end_step(self.steps)
+        self.tick()
 
     def advance(self, dt):
         """Advance the animation by dt."""
         
-        for i, p in enumerate(self.particles):
-            p.advance(dt)
-        self.people_interactions()
+        profiler = self.profiler
+        n = len(self.particles)
+        with profiler.phase('advance', n):
+            self.store.advance(dt)
+        # people_interactions reports the number of pairs in contact.
+        with profiler.phase('people_interactions'):
+            self.people_interactions()
+        profiler.end_step(self.steps)
 
 
     
     def count_states(self):
         """counts the number of particles with each state"""
-        self.count = {}
-        
-        self.num_infected = len(self.infected_particles)
-        self.num_recovered = len(self.recovered_particles)
-        self.num_dead = len(self.dead_particles)
-        self.num_vaccinated = len(self.vaccinated_particles)
-        self.num_noninfected = len(self.particles) - self.num_infected - self.num_recovered - self.num_dead - self.num_vaccinated
-        
-        self.count["non-infected"] = self.num_noninfected
-        self.count["infected"] = self.num_infected
-        self.count["recovered"] = self.num_recovered
-        self.count["dead"] = self.num_dead
-        self.count["vaccinated"] = self.num_vaccinated
+        counts = np.bincount(self.states, minlength=len(self.STATE_CODES))
+        self.count = {status: int(counts[code])
+                      for status, code in self.STATE_CODES.items()}
         return self.count
-    
-    
 
-    
+    def get_states(self):
+        """Array with the STATE_CODES of every particle (a copy)"""
+
+        return self.states.copy()
+
+    def save_checkpoint(self, filename):
+        """Save the simulation so that it can be resumed with load_checkpoint
+
+        The checkpoint is a compressed numpy .npz file with the positions,
+        velocities, radii, states and ages of the particles, the day each
+        particle was infected (nan if never), the clock and the state of the
+        random number generator.
+        """
+        np.savez_compressed(filename,
+            r=self.store.positions,
+            v=self.store.velocities,
+            radius=self.store.radii,
+            states=self.states,
+            time_infected=self.time_infected,
+            ages=self.ages,
+            day=self.day,
+            steps=self.steps,
+            steps_per_day=self.steps_per_day,
+            cases=self.cases,
+            age_group=self.age_group,
+            vaccination_rate=self.vaccination_rate,
+            rng_state=json.dumps(self.rng.bit_generator.state))
+
+    @classmethod
+    def load_checkpoint(cls, filename, styles=None):
+        """Create a simulation from a file written by save_checkpoint"""
+
+        simulation = cls.__new__(cls)
+        simulation.profiler = NULL_PROFILER
+        with np.load(filename) as data:
+            simulation.day = data['day'].item()
+            simulation.steps = data['steps'].item()
+            simulation.steps_per_day = data['steps_per_day'].item()
+            simulation.cases = data['cases'].item()
+            simulation.age_group = data['age_group'].item()
+            simulation.vaccination_rate = data['vaccination_rate'].item()
+
+            states = data['states']
+            simulation.n = len(states)
+            simulation.infected = simulation.cases
+            simulation.particles = []
+            simulation.store = ParticleStore(len(states))
+            simulation.states = states.astype(np.uint8)
+            simulation.time_infected = data['time_infected']
+            simulation.ages = data['ages'].astype(int)
+            codes = {code: status for status, code in cls.STATE_CODES.items()}
+            # Every data[...] decompresses the whole array, so read each once.
+            r, v, radius = data['r'], data['v'], data['radius']
+            for i, code in enumerate(states):
+                (x, y), (vx, vy) = r[i], v[i]
+                status = codes[code]
+                particle = Particle(x, y, vx, vy, radius[i],
+                                    cls.STYLES.get(status, styles))
+                simulation.particles.append(particle)
+                simulation.store.add(particle)
+
+            simulation.rng = np.random.default_rng()
+            simulation.rng.bit_generator.state = json.loads(data['rng_state'].item())
+
+        return simulation
+
     def do_animation(self):
         """Set up and carry out the animation of the molecular dynamics.
         To save the animation as a MP4 movie, set save=True.
@@ -418,7 +709,7 @@ class Simulation:
     def line_init(self): 
         """initiates the line graph onto the figure"""
         
-        self.xvalues = [self.day]
+        self.xvalues = [self.clock]
         self.yvalues = {status : [] for status in self.COLOURS}
         self.lines = {}
         self.count_states()
@@ -446,8 +737,7 @@ class Simulation:
         """updates the line graph """
         
         self.count_states()
-        self.day+=1
-        self.xvalues.append(self.day)
+        self.xvalues.append(self.clock)
         
         for status,value in self.count.items():
                 self.yvalues[status] = self.yvalues.get(status,[]) + [value]
@@ -0,0 +1,154 @@
+import os
+import shutil
+import subprocess
+from multiprocessing import Pool
+
+import numpy as np
+
+
+def record(simulation, frames, dt=0.01):
+    """Run the simulation without drawing and record every frame
+
+    Returns (positions, states, counts, days): arrays of shape
+    (frames, n, 2), (frames, n), (frames, len(STATE_CODES)) and (frames,)
+    with the day on the simulation clock of each frame. Like the live
+    animation every frame is one step of the simulation by dt.
+    """
+    n = simulation.store.size
+    positions = np.zeros((frames, n, 2), np.float32)
+    states = np.zeros((frames, n), np.uint8)
+    days = np.zeros(frames)
+    for frame in range(frames):
+        simulation.step(dt)
+        positions[frame] = simulation.store.positions
+        states[frame] = simulation.states
+        days[frame] = simulation.clock
+
+    num_states = len(simulation.STATE_CODES)
+    counts = np.stack([np.bincount(s, minlength=num_states) for s in states])
+    return positions, states, counts, days
+
+
+# Figure of each worker process, created once by _init_worker.
+_worker = {}
+
+
+def _init_worker(radius, counts, days, colours, edges, pattern):
+    """Create the figure used by this worker process for all its frames"""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import EllipseCollection
+
+    figure = Figure(figsize=(10, 5))
+    canvas = FigureCanvasAgg(figure)
+    ax_grid, ax_line = figure.subplots(1, 2)
+
+    ax_grid.xaxis.set_ticks([])
+    ax_grid.yaxis.set_ticks([])
+    ax_grid.set(xlim=(0, 2), ylim=(0, 2))
+    for s in ['top', 'bottom', 'left', 'right']:
+        ax_grid.spines[s].set_linewidth(2)
+    ax_grid.set_aspect('equal', 'box')
+    circles = EllipseCollection(2 * radius, 2 * radius, np.zeros_like(radius),
+                                units='xy', offsets=np.zeros((len(radius), 2)),
+                                transOffset=ax_grid.transData,
+                                facecolor='C0', linewidth=2)
+    ax_grid.add_collection(circles)
+
+    lines = []
+    for status, colour in colours.items():
+        [line] = ax_line.plot([], [], color=colour, label=status, linewidth=2)
+        lines.append(line)
+    ax_line.set_xlim(days[0], max(days[-1], days[0] + 1))
+    ax_line.set_ylim(0, len(radius))
+    ax_line.set_xlabel('days')
+    ax_line.set_ylabel('number of people', rotation=90)
+    ax_line.legend(loc='upper right')
+
+    _worker.update(figure=figure, canvas=canvas, circles=circles,
+                   lines=lines, counts=counts, days=days, edges=edges,
+                   pattern=pattern)
+
+
+def _render(job):
+    """Draw one frame and return its size and raw RGBA bytes (or save it as PNG)"""
+    frame, positions, states = job
+    circles = _worker['circles']
+    circles.set_offsets(positions)
+    circles.set_edgecolor([_worker['edges'][s] for s in states])
+
+    days = _worker['days'][:frame + 1]
+    for code, line in enumerate(_worker['lines']):
+        line.set_data(days, _worker['counts'][:frame + 1, code])
+
+    if _worker['pattern'] is not None:
+        _worker['figure'].savefig(_worker['pattern'] % frame)
+        return None
+    canvas = _worker['canvas']
+    canvas.draw()
+    return canvas.get_width_height(), bytes(canvas.buffer_rgba())
+
+
+def export_video(simulation, filename, frames=100, workers=None, fps=10,
+                 dt=0.01):
+    """Simulate frames frames and save them as a video, rendered in parallel
+
+    The simulation is first run without drawing while recording positions
+    and states. The frames are then drawn by a pool of worker processes and
+    piped in order to ffmpeg, which writes filename (e.g. .mp4 or .gif). If
+    ffmpeg is not installed the frames are saved as numbered PNG files
+    instead, e.g. video_00000.png for video.mp4.
+
+    Returns the name of the video or the pattern of the PNG files.
+
+    Example
+    =======
+
+    >>> sim = Simulation(10000, 0.002, 20, 1, styles)
+    >>> export_video(sim, 'epidemic.mp4', frames=2000)
+
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    positions, states, counts, days = record(simulation, frames, dt)
+    radius = simulation.store.radii.copy()
+    # Same colours as the live animation, in the order of the state codes.
+    colours = {status: simulation.COLOURS[status]
+               for status in simulation.STATE_CODES}
+    edges = [simulation.STYLES.get(status, {'edgecolor': 'C0'})['edgecolor']
+             for status in simulation.STATE_CODES]
+    jobs = ((frame, positions[frame], states[frame]) for frame in range(frames))
+
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        pattern = os.path.splitext(filename)[0] + '_%05d.png'
+    else:
+        pattern = None
+
+    initargs = (radius, counts, days, colours, edges, pattern)
+    with Pool(workers, _init_worker, initargs) as pool:
+        # imap keeps the frames in order while several are drawn at once.
+        rendered = pool.imap(_render, jobs, chunksize=4)
+        if ffmpeg is None:
+            for _ in rendered:
+                pass
+            return pattern
+
+        (width, height), first = next(rendered)
+        command = [ffmpeg, '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgba',
+                   '-s', '%dx%d' % (width, height), '-r', str(fps), '-i', '-']
+        if not filename.endswith('.gif'):
+            command += ['-vcodec', 'libx264', '-pix_fmt', 'yuv420p']
+        command.append(filename)
+
+        encoder = subprocess.Popen(command, stdin=subprocess.PIPE)
+        encoder.stdin.write(first)
+        for _, image in rendered:
+            encoder.stdin.write(image)
+        encoder.stdin.close()
+        if encoder.wait() != 0:
+            raise RuntimeError('ffmpeg failed to write %s' % filename)
+    return filename
+